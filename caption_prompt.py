@@ -0,0 +1,96 @@
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Bump when the caption prompt changes so cached captions are not reused
+CAPTION_PROMPT_VERSION = "3"
+# Upper bound on the tokens spent on frame descriptions in one caption request
+CAPTION_DESCRIPTION_TOKEN_BUDGET = int(os.environ.get("CAPTION_DESCRIPTION_TOKEN_BUDGET", "1200"))
+# Rough size of a token in English text; close enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+# Shortest description worth sending; when the budget cannot give every frame this much,
+# an evenly spread subset of the frames is kept instead
+MIN_DESCRIPTION_CHARS = 160
+
+# Identical on every request and sent first, so providers that cache prompt prefixes can reuse it
+CAPTION_SYSTEM_PROMPT = (
+    "You write social media captions from descriptions of an image, or of frames sampled from one video. "
+    "Read every description and caption the post as a whole.\n"
+    "Write 4 distinct, eye-catching captions. Each has a short title that may end with one or two emoji, "
+    "and a text of 2-3 sentences built on concrete details from the descriptions.\n"
+    "Reply with JSON only, in exactly this shape:\n"
+    '{"captions": [{"title": "...", "text": "..."}, {"title": "...", "text": "..."}, '
+    '{"title": "...", "text": "..."}, {"title": "...", "text": "..."}]}'
+)
+CAPTION_USER_TEMPLATE = "Descriptions:\n{descriptions}"
+
+_MARKDOWN = re.compile(r"\*\*|__|^\s*[*\-•]\s+|^#+\s*", re.MULTILINE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def compact_description(description):
+    """
+    Strip the markdown (bold, bullets, headings) the vision model adds and collapse whitespace.
+    """
+    return _WHITESPACE.sub(" ", _MARKDOWN.sub("", str(description))).strip()
+
+
+def truncate(text, max_chars):
+    """
+    Cut text to at most max_chars, at a sentence end when one falls in the second half.
+    """
+    if max_chars <= 0:
+        return ""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    if end >= max_chars // 2:
+        return cut[:end + 1]
+    return cut[:max_chars - 1].rstrip() + "…"
+
+
+def fit_descriptions(results, token_budget=CAPTION_DESCRIPTION_TOKEN_BUDGET):
+    """
+    Compact each description and truncate them so together they fit token_budget.
+    The vision model opens with a summary, so the start of each description is kept.
+    Every description gets an equal share; shorter ones pass what they do not use
+    on to the longer ones. When there are too many frames for each to get
+    MIN_DESCRIPTION_CHARS, frames spread evenly over the video are kept and the
+    others come back empty. The "key: " prefix of each line counts against the budget.
+    """
+    texts = {key: compact_description(description) for key, description in results.items()}
+    keys = list(texts)
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    max_kept = max(1, budget_chars // MIN_DESCRIPTION_CHARS)
+    if len(keys) > max_kept:
+        step = len(keys) / max_kept
+        kept = [keys[int(i * step)] for i in range(max_kept)]
+    else:
+        kept = keys
+
+    remaining = budget_chars - sum(len(key) + 3 for key in kept)
+    fitted = dict.fromkeys(keys, "")
+    for position, key in enumerate(sorted(kept, key=lambda key: len(texts[key]))):
+        share = max(remaining, 0) // (len(kept) - position)
+        fitted[key] = truncate(texts[key], share)
+        remaining -= len(fitted[key])
+    return fitted
+
+
+def build_caption_messages(results, token_budget=CAPTION_DESCRIPTION_TOKEN_BUDGET):
+    """
+    Chat messages for the caption request: the static system prompt, then the
+    frame descriptions in results fitted to token_budget.
+    """
+    # Frames left with no room in the budget are dropped rather than listed empty
+    descriptions = "\n".join(
+        f"{key}: {description}"
+        for key, description in fit_descriptions(results, token_budget).items() if description
+    )
+    return [
+        {"role": "system", "content": CAPTION_SYSTEM_PROMPT},
+        {"role": "user", "content": CAPTION_USER_TEMPLATE.format(descriptions=descriptions)},
+    ]
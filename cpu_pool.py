@@ -0,0 +1,83 @@
+import collections
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "thread" suits OpenCV and Pillow, which release the GIL while they work;
+# "process" also spreads the Python-level work over every core
+CPU_POOL_MODE = os.environ.get("CPU_POOL_MODE", "thread")
+CPU_POOL_WORKERS = int(os.environ.get("CPU_POOL_WORKERS", str(os.cpu_count() or 2)))
+# Calls queued or running at once; submitters block beyond this
+CPU_POOL_MAX_PENDING = int(os.environ.get("CPU_POOL_MAX_PENDING", str(2 * CPU_POOL_WORKERS)))
+
+
+class CPUPool:
+    """
+    Shared pool for CPU-bound media work (JPEG encoding, frame conversion).
+
+    At most max_pending calls are queued or running across the process;
+    submit() blocks until a slot frees up. Callers such as a video decoder are
+    therefore slowed to the speed of the workers instead of piling decoded
+    frames up in memory. The executor is created on first use, so importing
+    this module never starts worker processes.
+    """
+
+    def __init__(self, mode=CPU_POOL_MODE, workers=CPU_POOL_WORKERS, max_pending=CPU_POOL_MAX_PENDING):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown CPU pool mode: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                executor_class = ProcessPoolExecutor if self.mode == "process" else ThreadPoolExecutor
+                self._executor = executor_class(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) on the pool and return its future, waiting for a free slot first.
+        In process mode fn and args must be picklable (module-level functions, arrays, bytes).
+        """
+        self._slots.acquire()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def map(self, fn, items, *args):
+        """
+        Yield fn(item, *args) for each item, in order. Up to `workers` calls from
+        this iterator run at once, and items are only pulled as results are
+        consumed or slots free up.
+        """
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append(self.submit(fn, item, *args))
+                if len(pending) >= self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+cpu_pool = CPUPool()
@@ -1,79 +1,441 @@
 
 import base64
+import functools
+import hashlib
+import json
+import math
 import openai
 import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from smma_apis.rate_limit import account_id, call_with_limits
+from cpu_pool import cpu_pool
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
 import io
 
 load_dotenv()
 
+VISION_MODEL = "llama-3.2-90b-vision-preview"
+# Bump when the vision prompt changes so cached descriptions are not reused
+VISION_PROMPT_VERSION = "1"
+# Upper bound on vision requests in flight at once, shared by every caller in the process
+VISION_MAX_CONCURRENCY = int(os.environ.get("VISION_MAX_CONCURRENCY", "4"))
+# Groq accepts at most 5 images in a single vision request
+MAX_IMAGES_PER_REQUEST = 5
+
+_vision_slots = threading.BoundedSemaphore(VISION_MAX_CONCURRENCY)
+
+# Llama 3.2 Vision works on images of at most 1120px per side; larger inputs only cost bandwidth
+VISION_MAX_IMAGE_SIDE = int(os.environ.get("VISION_MAX_IMAGE_SIDE", "1120"))
+FRAME_JPEG_QUALITY = 85
+# Uploaded images are re-encoded at lower qualities, down to the minimum, until they fit this size
+VISION_TARGET_IMAGE_BYTES = int(os.environ.get("VISION_TARGET_IMAGE_BYTES", str(300 * 1024)))
+VISION_MIN_JPEG_QUALITY = 60
+# EXIF tag holding the rotation exif_transpose applies
+ORIENTATION_TAG = 0x0112
+
+# Frames closer than this to the previously kept frame are treated as duplicates
+KEYFRAME_MIN_DISTANCE = float(os.environ.get("KEYFRAME_MIN_DISTANCE", "0.08"))
+# Sampling step used to find scene changes when a frame budget is given
+KEYFRAME_CANDIDATE_INTERVAL = float(os.environ.get("KEYFRAME_CANDIDATE_INTERVAL", "2"))
+
+# Gaps (in frames) longer than this are crossed by seeking rather than grabbing
+SEEK_MIN_GAP_FRAMES = int(os.environ.get("SEEK_MIN_GAP_FRAMES", "90"))
+
 # Function to encode the image
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
+def preprocess_image(pil_image, max_side=VISION_MAX_IMAGE_SIDE, target_bytes=VISION_TARGET_IMAGE_BYTES):
+    """
+    Return JPEG bytes of pil_image ready for a vision request: rotated upright
+    from its EXIF orientation, flattened onto white if it has transparency,
+    downscaled so its longest side is at most max_side, and saved at the
+    highest quality (FRAME_JPEG_QUALITY down to VISION_MIN_JPEG_QUALITY) that
+    fits target_bytes. The caller's image is left unchanged.
+    """
+    image = ImageOps.exif_transpose(pil_image)
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    width, height = image.size
+    scale = max_side / max(width, height)
+    if scale < 1:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+
+    qualities = list(range(FRAME_JPEG_QUALITY, VISION_MIN_JPEG_QUALITY, -10)) + [VISION_MIN_JPEG_QUALITY]
+    for quality in qualities:
+        buffered = io.BytesIO()
+        image.save(buffered, format="JPEG", quality=quality, optimize=True)
+        if buffered.tell() <= target_bytes:
+            break
+    return buffered.getvalue()
+
+def _needs_no_preprocessing(pil_image, max_side):
+    # An upright RGB or greyscale JPEG within max_side would come out of
+    # preprocess_image unchanged apart from a lossy re-encode
+    return (
+        pil_image.format == "JPEG"
+        and pil_image.mode in ("RGB", "L")
+        and pil_image.getexif().get(ORIENTATION_TAG, 1) == 1
+        and max(pil_image.size) <= max_side
+    )
+
+def prepare_image(image, max_side=VISION_MAX_IMAGE_SIDE, target_bytes=VISION_TARGET_IMAGE_BYTES):
+    """
+    preprocess_image for image bytes or an image path, printing the bytes saved.
+    A JPEG that needs no rotation, flattening or resize is sent as it is when
+    it fits target_bytes, and otherwise only replaced by a smaller re-encode.
+    """
+    if not isinstance(image, (bytes, bytearray)):
+        with open(image, "rb") as image_file:
+            image = image_file.read()
+    original_bytes = len(image)
+    with Image.open(io.BytesIO(image)) as img:
+        as_is = _needs_no_preprocessing(img, max_side)
+        if as_is and original_bytes <= target_bytes:
+            prepared = bytes(image)
+        else:
+            prepared = preprocess_image(img, max_side, target_bytes)
+            if as_is and original_bytes < len(prepared):
+                prepared = bytes(image)
+    saved = original_bytes - len(prepared)
+    print(f"Vision image: {original_bytes} -> {len(prepared)} bytes ({saved * 100 // max(original_bytes, 1)}% saved)")
+    return prepared
+
 # Function to encode a PIL Image
 def encode_pil_image(pil_image):
-    buffered = io.BytesIO()
-    pil_image.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    return base64.b64encode(preprocess_image(pil_image)).decode('utf-8')
 
-# Function to take screenshots from a video and save them
-def take_screenshots(video_path, interval):
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_interval = int(fps * interval)
-    screenshots = []
-    
-    # Create video_screenshots folder if it doesn't exist
-    os.makedirs("video_screenshots", exist_ok=True)
-    
-    frame_count = 0
-    screenshot_count = 0
-    while True:
+def _sample_by_frame_index(cap, fps, interval):
+    frame_total = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    step = max(1, int(round(fps * interval)))
+    position = 0
+    index = 0
+    while frame_total <= 0 or index < frame_total:
+        gap = index - position
+        # Seeking lands on a keyframe and decodes forward, which only pays off for long gaps;
+        # short gaps are skipped with grab(), which demuxes without decoding
+        if gap > SEEK_MIN_GAP_FRAMES and cap.set(cv2.CAP_PROP_POS_FRAMES, index):
+            position = index
+        while position < index:
+            if not cap.grab():
+                return
+            position += 1
         ret, frame = cap.read()
         if not ret:
-            break
-        
-        if frame_count % frame_interval == 0:
-            pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-            screenshot_path = f"video_screenshots/screenshot_{screenshot_count:03d}.jpg"
-            pil_image.save(screenshot_path)
-            screenshots.append(screenshot_path)
-            screenshot_count += 1
-        
-        frame_count += 1
+            return
+        position += 1
+        yield frame
+        index += step
+
+def _sample_by_timestamp(cap, interval):
+    # Without a usable frame rate, walk the stream with grab() and only decode
+    # the first frame at or after each sample timestamp
+    next_sample_ms = 0.0
+    while cap.grab():
+        if cap.get(cv2.CAP_PROP_POS_MSEC) + 0.5 >= next_sample_ms:
+            ret, frame = cap.retrieve()
+            if not ret:
+                return
+            yield frame
+            next_sample_ms += interval * 1000
+
+def iter_video_frames(video_path, interval):
+    """
+    Yield one BGR frame every `interval` seconds of video without decoding the
+    frames in between. Falls back to timestamp sampling when the container does
+    not report a frame rate.
+    """
+    if interval <= 0:
+        raise ValueError("interval must be a positive number of seconds")
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if fps and math.isfinite(fps) and fps > 0:
+            yield from _sample_by_frame_index(cap, fps, interval)
+        else:
+            yield from _sample_by_timestamp(cap, interval)
+    finally:
+        cap.release()
+
+def _save_screenshot(numbered_frame, output_dir):
+    screenshot_count, frame = numbered_frame
+    pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    screenshot_path = os.path.join(output_dir, f"screenshot_{screenshot_count:03d}.jpg")
+    pil_image.save(screenshot_path)
+    return screenshot_path
+
+# Function to take screenshots from a video and save them
+def take_screenshots(video_path, interval, output_dir=None):
+    """
+    Save a frame every `interval` seconds as a JPEG and return the paths.
+    Without output_dir a new private temp directory is created, so concurrent
+    calls never overwrite each other's frames; the caller removes it, or uses
+    screenshot_workspace() to have it removed.
+    Frames are converted and saved on the shared CPU pool while decoding continues.
+    """
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp(prefix="video_screenshots_")
+    else:
+        os.makedirs(output_dir, exist_ok=True)
     
-    cap.release()
-    return screenshots
-
-def process_images(image_paths, client):
-    results = []
-    for i, image_path in enumerate(image_paths):
-        with Image.open(image_path) as img:
-            base64_image = encode_pil_image(img)
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": f"What's in this image? (Image {i+1})"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                            },
-                        },
-                    ],
-                }
-            ],
-            model="llama-3.2-90b-vision-preview",
-        )
-        results.append(chat_completion.choices[0].message.content)
-    return results
+    frames = enumerate(iter_video_frames(video_path, interval))
+    return list(cpu_pool.map(_save_screenshot, frames, output_dir))
+
+@contextmanager
+def screenshot_workspace(video_path, interval):
+    """
+    take_screenshots into a temp directory that is deleted on exit, even on errors.
+    """
+    output_dir = tempfile.mkdtemp(prefix="video_screenshots_")
+    try:
+        yield take_screenshots(video_path, interval, output_dir)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+def encode_frame(frame, max_side=VISION_MAX_IMAGE_SIDE):
+    """
+    JPEG-encode a BGR frame straight from OpenCV, downscaled so its longest side
+    is at most max_side. cv2.imencode expects BGR, so no colour conversion is needed.
+    """
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, FRAME_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode video frame as JPEG")
+    return buffer.tobytes()
+
+def _frame_signature(frame):
+    # A 64x36 thumbnail is enough to tell scenes apart and costs almost nothing to compare
+    small = cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA)
+    pixels = small.shape[0] * small.shape[1]
+    histogram = np.concatenate([
+        np.bincount((small[..., channel] >> 4).ravel(), minlength=16) for channel in range(3)
+    ]).astype(np.float32) / pixels
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+    return histogram, gray
+
+def frame_distance(signature_a, signature_b):
+    """
+    Distance in [0, 1] between two frame signatures: the larger of the colour
+    histogram distance (catches cuts) and the mean pixel difference (catches
+    motion within a similar palette).
+    """
+    histogram_a, gray_a = signature_a
+    histogram_b, gray_b = signature_b
+    histogram_distance = float(np.abs(histogram_a - histogram_b).sum()) / 6
+    pixel_distance = float(np.abs(gray_a - gray_b).mean()) / 255
+    return max(histogram_distance, pixel_distance)
+
+def drop_near_duplicates(frames, min_distance=KEYFRAME_MIN_DISTANCE):
+    """
+    Yield (frame, distance) for every frame that differs from the previously
+    kept frame by at least min_distance. The first frame is always kept, with
+    distance 1.0.
+    """
+    previous = None
+    for frame in frames:
+        signature = _frame_signature(frame)
+        distance = 1.0 if previous is None else frame_distance(previous, signature)
+        if distance >= min_distance:
+            previous = signature
+            yield frame, distance
+
+def select_keyframes(scored_frames, max_frames):
+    """
+    Keep at most max_frames of the (frame, distance) pairs from
+    drop_near_duplicates, preferring the biggest scene changes, and return the
+    frames in their original order. Only max_frames + 1 frames are held at once.
+    """
+    kept = []
+    for frame, distance in scored_frames:
+        kept.append((frame, distance))
+        if len(kept) > max_frames:
+            # Never evict the opening frame; drop the least distinct of the rest
+            weakest = min(range(1, len(kept)), key=lambda i: kept[i][1])
+            del kept[weakest]
+    return [frame for frame, _ in kept]
+
+def iter_frame_jpegs(video_path, interval, max_side=VISION_MAX_IMAGE_SIDE, max_frames=None):
+    """
+    Yield JPEG bytes for the frames to describe, ready for process_images.
+    Nothing is written to disk. Encoding runs on the shared CPU pool, which
+    holds the decoder back when the workers fall behind.
+
+    Frames are sampled every `interval` seconds and near-duplicates are dropped.
+    With max_frames, candidates are sampled more densely (at most every
+    KEYFRAME_CANDIDATE_INTERVAL seconds, so quick cuts are not missed) and the
+    max_frames most distinct ones are kept.
+    """
+    if max_frames:
+        candidates = iter_video_frames(video_path, min(interval, KEYFRAME_CANDIDATE_INTERVAL))
+        frames = select_keyframes(drop_near_duplicates(candidates), max_frames)
+    else:
+        frames = (frame for frame, _ in drop_near_duplicates(iter_video_frames(video_path, interval)))
+    yield from cpu_pool.map(encode_frame, frames, max_side)
+
+def _image_part(image):
+    # image is either prepared JPEG bytes (iter_frame_jpegs, prepare_image) or a path to an image file
+    if isinstance(image, (bytes, bytearray)):
+        base64_image = base64.b64encode(image).decode('utf-8')
+    else:
+        base64_image = base64.b64encode(prepare_image(image)).decode('utf-8')
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/jpeg;base64,{base64_image}",
+        },
+    }
+
+def _rate_limit_headers(error):
+    if isinstance(error, openai.RateLimitError):
+        return error.response.headers if error.response is not None else {}
+    return None
+
+def _create_completion(client, content):
+    def call():
+        # The shared semaphore caps in-flight vision calls across every request in the process
+        with _vision_slots:
+            return client.chat.completions.create(
+                messages=[{"role": "user", "content": content}],
+                model=VISION_MODEL,
+            )
+    # Rate-limit waits happen outside the semaphore, so other calls can use the slot meanwhile
+    return call_with_limits("groq", account_id(client.api_key), call, _rate_limit_headers)
+
+def _describe_batch(client, batch):
+    """
+    Describe a batch of (index, image) pairs and return the descriptions in
+    the same order. Several images are packed into one request when the batch
+    has more than one entry; if the answer cannot be split back into one
+    description per image, each image is described on its own instead.
+    """
+    if len(batch) == 1:
+        i, image = batch[0]
+        content = [
+            {"type": "text", "text": f"What's in this image? (Image {i+1})"},
+            _image_part(image),
+        ]
+        return [_create_completion(client, content).choices[0].message.content]
+
+    labels = [f"Image {i+1}" for i, _ in batch]
+    content = [{
+        "type": "text",
+        "text": (
+            f"Describe what's in each of these {len(batch)} images separately. "
+            f"Answer only with a JSON object whose keys are {json.dumps(labels)} "
+            "and whose values are the descriptions."
+        ),
+    }]
+    for _, image in batch:
+        content.append(_image_part(image))
+
+    answer = _create_completion(client, content).choices[0].message.content.strip()
+    if answer.startswith("```"):
+        answer = answer.strip("`").removeprefix("json").strip()
+    try:
+        descriptions = json.loads(answer)
+        return [str(descriptions[label]) for label in labels]
+    except (ValueError, KeyError, TypeError):
+        return [description for entry in batch for description in _describe_batch(client, [entry])]
+
+def _description_key(image):
+    if isinstance(image, (bytes, bytearray)):
+        data = bytes(image)
+    else:
+        with open(image, "rb") as image_file:
+            data = image_file.read()
+    return f"description:{VISION_MODEL}:{VISION_PROMPT_VERSION}:{hashlib.sha256(data).hexdigest()}"
+
+def _describe_batch_cached(client, batch, cache):
+    # Only the images without a cached description are sent to the model
+    keys = [_description_key(image) for _, image in batch]
+    descriptions = [cache.get(key) for key in keys]
+    missing = [entry for entry, description in zip(batch, descriptions) if description is None]
+    if missing:
+        fresh = iter(_describe_batch(client, missing))
+        for position, description in enumerate(descriptions):
+            if description is None:
+                descriptions[position] = next(fresh)
+                cache.set(keys[position], descriptions[position])
+    return descriptions
+
+def iter_image_descriptions(images, client, max_workers=VISION_MAX_CONCURRENCY, images_per_request=1, cache=None):
+    """
+    Describe every image with the vision model, yielding (index, description)
+    pairs as soon as each one finishes, so in completion order rather than
+    input order.
+
+    images may be file paths or JPEG bytes, and may be a generator such as
+    iter_frame_jpegs: requests are submitted as soon as each batch is
+    available, so frames are still being extracted while earlier ones are
+    being described. At most max_workers requests are pending at once; no
+    further images are pulled until one finishes, so a slow or rate-limited
+    API holds the source back instead of buffering every frame. Requests run
+    concurrently on up to max_workers threads,
+    and images_per_request > 1 packs several images into one request (the
+    model accepts at most MAX_IMAGES_PER_REQUEST).
+
+    cache is an optional object with get(key) and set(key, value), such as
+    media_cache.cache. Descriptions are keyed by image content, model and
+    prompt version, so an image that was already described costs no API call.
+    """
+    images_per_request = max(1, min(images_per_request, MAX_IMAGES_PER_REQUEST))
+    if cache is None:
+        describe = _describe_batch
+    else:
+        describe = functools.partial(_describe_batch_cached, cache=cache)
+
+    max_workers = max(1, max_workers)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending = {}
+
+        def finished(block):
+            done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, description in zip(pending.pop(future), future.result()):
+                    yield index, description
+
+        batch = []
+        for indexed_image in enumerate(images):
+            batch.append(indexed_image)
+            if len(batch) == images_per_request:
+                pending[pool.submit(describe, client, batch)] = [index for index, _ in batch]
+                batch = []
+                yield from finished(block=len(pending) >= max_workers)
+        if batch:
+            pending[pool.submit(describe, client, batch)] = [index for index, _ in batch]
+        while pending:
+            yield from finished(block=True)
+    except BaseException:
+        # The consumer went away (e.g. an SSE client disconnected) or a request
+        # failed: drop the requests that have not started instead of paying for them
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+def process_images(images, client, max_workers=VISION_MAX_CONCURRENCY, images_per_request=1, cache=None):
+    """
+    Same as iter_image_descriptions, but waits for every image and returns the
+    descriptions as a list in input order.
+    """
+    descriptions = dict(iter_image_descriptions(images, client, max_workers, images_per_request, cache))
+    return [descriptions[index] for index in range(len(descriptions))]
 
 def main():
     client = openai.OpenAI(
@@ -89,8 +451,8 @@ def main():
     elif choice == '2':
         video_path = input("Enter the path to your video: ")
         interval = int(input("Enter the interval for screenshots in seconds (e.g., 30 or 60): "))
-        screenshot_paths = take_screenshots(video_path, interval)
-        results = process_images(screenshot_paths, client)
+        with screenshot_workspace(video_path, interval) as screenshot_paths:
+            results = process_images(screenshot_paths, client)
     else:
         print("Invalid choice. Please run the script again and enter either '1' or '2'.")
         return
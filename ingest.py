@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart releases before 0.0.13 install the package as "multipart"
+    from multipart.multipart import MultipartParser, parse_options_header
+
+load_dotenv()
+
+# Largest file accepted in one upload; bigger bodies are refused before or while they are read
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+# Uploads up to this size stay in memory and never touch the disk
+UPLOAD_IN_MEMORY_MAX = int(os.environ.get("UPLOAD_IN_MEMORY_MAX", str(8 * 1024 * 1024)))
+# Room left for the non-file form fields
+FORM_FIELDS_MAX_BYTES = 64 * 1024
+
+
+class IngestedFile:
+    """
+    An uploaded file read once from the request body and hashed as it arrived.
+
+    Files up to the in-memory limit are kept in `data`; larger ones were written
+    to `path` as they streamed in. as_path() writes in-memory data out only for
+    readers that need a real file (OpenCV), so every upload is written to disk
+    at most once. close() removes the file unless it was handed off with keep().
+    """
+
+    def __init__(self, filename=None, content_type=None, path=None, sha256=None, directory=None):
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.sha256 = sha256
+        self.data = None
+        self.size = os.path.getsize(path) if path else 0
+        self.directory = directory
+        self._owned = False
+        self._digest = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    @property
+    def suffix(self):
+        return os.path.splitext(self.filename or "")[1]
+
+    def source(self):
+        """
+        The content as bytes when it is in memory, otherwise the file path.
+        """
+        return self.data if self.data is not None else self.path
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def as_path(self):
+        if self.path is None:
+            with tempfile.NamedTemporaryFile(delete=False, dir=self.directory, suffix=self.suffix) as temp_file:
+                temp_file.write(self.data)
+            self.path = temp_file.name
+            self._owned = True
+        return self.path
+
+    def keep(self):
+        """
+        Hand the file on disk over to the caller, so close() leaves it in place.
+        """
+        path = self.as_path()
+        self._owned = False
+        return path
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._owned and self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+        self._owned = False
+
+    async def _write(self, chunk, max_bytes, in_memory_max):
+        self.size += len(chunk)
+        if self.size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload is larger than {max_bytes} bytes")
+        self._digest.update(chunk)
+        if self._file is None and self.size <= in_memory_max:
+            self._buffer.extend(chunk)
+            return
+        if self._file is None:
+            self._file = await asyncio.to_thread(
+                tempfile.NamedTemporaryFile, delete=False, dir=self.directory, suffix=self.suffix
+            )
+            self.path = self._file.name
+            self._owned = True
+            chunk = bytes(self._buffer) + chunk
+            self._buffer = bytearray()
+        await asyncio.to_thread(self._file.write, chunk)
+
+    async def _finish(self):
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+        else:
+            self.data = bytes(self._buffer)
+            self._buffer = bytearray()
+        self.sha256 = self._digest.hexdigest()
+
+
+class _PartCollector:
+    # python-multipart calls these synchronously from parser.write(); the parts
+    # are queued and processed afterwards so file writes can be awaited
+    def __init__(self):
+        self.events = []
+        self._headers = {}
+        self._field = bytearray()
+        self._value = bytearray()
+
+    def on_part_begin(self):
+        self._headers = {}
+
+    def on_header_field(self, data, start, end):
+        self._field.extend(data[start:end])
+
+    def on_header_value(self, data, start, end):
+        self._value.extend(data[start:end])
+
+    def on_header_end(self):
+        self._headers[bytes(self._field).lower()] = bytes(self._value)
+        self._field = bytearray()
+        self._value = bytearray()
+
+    def on_headers_finished(self):
+        self.events.append(("headers", self._headers))
+
+    def on_part_data(self, data, start, end):
+        self.events.append(("data", data[start:end]))
+
+    def on_part_end(self):
+        self.events.append(("end", None))
+
+
+async def ingest_form(request, file_field="file", directory=None, max_bytes=MAX_UPLOAD_BYTES, in_memory_max=UPLOAD_IN_MEMORY_MAX):
+    """
+    Read a multipart/form-data request body in a single pass and return
+    (fields, upload): the text fields as a dict and the file sent as
+    file_field as an IngestedFile (None when it is missing). Files larger than
+    in_memory_max are written to `directory` as they arrive.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes + FORM_FIELDS_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload is larger than {max_bytes} bytes")
+
+    collector = _PartCollector()
+    parser = MultipartParser(params[b"boundary"], {
+        name: getattr(collector, name) for name in (
+            "on_part_begin", "on_header_field", "on_header_value", "on_header_end",
+            "on_headers_finished", "on_part_data", "on_part_end",
+        )
+    })
+    fields = {}
+    fields_size = 0
+    upload = None
+    current = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            events, collector.events = collector.events, []
+            for kind, value in events:
+                if kind == "headers":
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    name = options.get(b"name", b"").decode("utf-8", "replace")
+                    if b"filename" in options:
+                        if name == file_field and upload is None:
+                            filename = options[b"filename"].decode("utf-8", "replace")
+                            upload = IngestedFile(filename, value.get(b"content-type", b"").decode() or None, directory=directory)
+                            current = upload
+                        else:
+                            current = None
+                    else:
+                        current = fields.setdefault(name, bytearray())
+                elif kind == "data":
+                    if isinstance(current, IngestedFile):
+                        await current._write(value, max_bytes, in_memory_max)
+                    elif current is not None:
+                        fields_size += len(value)
+                        if fields_size > FORM_FIELDS_MAX_BYTES:
+                            raise HTTPException(status_code=413, detail="Form fields are too large")
+                        current.extend(value)
+                elif isinstance(current, IngestedFile):
+                    await current._finish()
+                    current = None
+        parser.finalize()
+        if upload is not None and upload.sha256 is None:
+            raise HTTPException(status_code=400, detail="Upload ended before the file was complete")
+    except BaseException:
+        if upload is not None:
+            upload.close()
+        raise
+
+    return {name: value.decode("utf-8", "replace") for name, value in fields.items()}, upload
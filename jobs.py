@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "jobs.db")
+# Number of jobs this process runs at once; 0 makes it submit-only
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Workers also poll, so jobs submitted by another process sharing the database are picked up
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))
+# Live processes mark the jobs they hold this often; jobs not marked for three
+# intervals belong to a process that died
+JOB_HEARTBEAT = float(os.environ.get("JOB_HEARTBEAT", "15"))
+
+
+class JobQueue:
+    """
+    Background job runner backed by SQLite, so queued jobs survive restarts.
+
+    Handlers are registered per job kind as coroutine functions taking
+    (payload, report_progress) and returning a JSON-serialisable result.
+    Several processes may share the database. Each one marks the jobs it holds
+    with a heartbeat, and only jobs whose heartbeat has gone stale are
+    recovered: queued again when their kind was registered with
+    retry_on_restart=True, and failed otherwise (e.g. publishing, where a blind
+    retry could post twice). Jobs submitted with pinned=True only run in the
+    submitting process, for jobs that depend on state kept in its memory.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL, heartbeat=JOB_HEARTBEAT):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.instance_id = uuid.uuid4().hex
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL,"
+            " payload TEXT NOT NULL, progress TEXT, result TEXT, error TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL,"
+            " owner TEXT, pinned TEXT, heartbeat_at REAL)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        for column in ("owner TEXT", "pinned TEXT", "heartbeat_at REAL"):
+            if column.split()[0] not in columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.commit()
+        self._wakeup = None
+        self._tasks = []
+
+    def register(self, kind, handler, retry_on_restart=False, cleanup=None):
+        """
+        cleanup(payload), if given, is called for jobs of this kind that are
+        failed because the process running or holding them died.
+        """
+        self._handlers[kind] = (handler, retry_on_restart, cleanup)
+
+    def submit(self, kind, payload, pinned=False):
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if pinned and self.workers == 0:
+            raise ValueError("This process runs no job workers, so it cannot take pinned jobs")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, pinned, heartbeat_at)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now, self.instance_id if pinned else None, now)
+            )
+            self._db.commit()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, status, progress, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "progress": json.loads(row[3]) if row[3] else None,
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+        }
+
+    def start(self):
+        self._recover()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._beat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _recover(self):
+        stale = time.time() - 3 * self.heartbeat
+        with self._lock:
+            for kind, (_, retry_on_restart, _) in self._handlers.items():
+                if retry_on_restart:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'queued', owner = NULL"
+                        " WHERE status = 'running' AND kind = ? AND pinned IS NULL"
+                        " AND COALESCE(heartbeat_at, updated_at) < ?",
+                        (kind, stale)
+                    )
+            # Pinned jobs can only run in the process that submitted them, so queued ones fail too
+            abandoned = self._db.execute(
+                "SELECT id, kind, payload FROM jobs WHERE COALESCE(heartbeat_at, updated_at) < ?"
+                " AND (status = 'running' OR (status = 'queued' AND pinned IS NOT NULL))",
+                (stale,)
+            ).fetchall()
+            failed = []
+            for job_id, kind, payload in abandoned:
+                # Another process may be recovering the same job; only the one that fails it cleans up
+                cursor = self._db.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart', updated_at = ?"
+                    " WHERE id = ? AND status IN ('queued', 'running')",
+                    (time.time(), job_id)
+                )
+                if cursor.rowcount == 1:
+                    failed.append((job_id, kind, payload))
+            self._db.commit()
+
+        for job_id, kind, payload in failed:
+            cleanup = self._handlers.get(kind, (None, None, None))[2]
+            if cleanup is not None:
+                try:
+                    cleanup(json.loads(payload))
+                except Exception as e:
+                    print(f"Cleaning up job {job_id} failed:", e)
+
+    async def _beat(self):
+        while True:
+            with self._lock:
+                self._db.execute(
+                    "UPDATE jobs SET heartbeat_at = ?"
+                    " WHERE status IN ('queued', 'running') AND (owner = ? OR pinned = ?)",
+                    (time.time(), self.instance_id, self.instance_id)
+                )
+                self._db.commit()
+            self._recover()
+            await asyncio.sleep(self.heartbeat)
+
+    def _claim(self):
+        # BEGIN IMMEDIATE takes the write lock, so two workers never claim the same job
+        kinds = list(self._handlers)
+        placeholders = ",".join("?" * len(kinds))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    f"SELECT id, kind, payload FROM jobs WHERE status = 'queued' AND kind IN ({placeholders})"
+                    " AND (pinned IS NULL OR pinned = ?) ORDER BY created_at LIMIT 1",
+                    (*kinds, self.instance_id)
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', owner = ?, heartbeat_at = ?, updated_at = ? WHERE id = ?",
+                        (self.instance_id, now, now, row[0])
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return row
+
+    def _update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE jobs SET {columns}, updated_at = ? WHERE id = ?",
+                (*fields.values(), time.time(), job_id)
+            )
+            self._db.commit()
+
+    async def _worker(self):
+        while True:
+            row = self._claim()
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, kind, payload = row
+            handler = self._handlers[kind][0]
+
+            def report_progress(progress, job_id=job_id):
+                self._update(job_id, progress=json.dumps(progress))
+
+            try:
+                result = await handler(json.loads(payload), report_progress)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job {job_id} failed:", e)
+                self._update(job_id, status="failed", error=str(e))
+            else:
+                self._update(job_id, status="succeeded", result=json.dumps(result))
+
+
+job_queue = JobQueue()
@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+import httpx
+import openai
+from dotenv import load_dotenv
+from langchain_community.chat_models import ChatAnthropic
+from langchain_openai import ChatOpenAI
+
+load_dotenv()
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+# How many distinct (provider, api_key, model) clients are kept alive at once
+LLM_CLIENT_CACHE_SIZE = int(os.environ.get("LLM_CLIENT_CACHE_SIZE", "32"))
+
+# Model name behind each caption llm_type that is served through LangChain
+CHAT_MODELS = {
+    "gpt-4o": ("openai", "gpt-4o"),
+    "claude-3-sonnet": ("anthropic", "claude-3-sonnet-20240229"),
+}
+
+_limits = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0)
+_timeout = httpx.Timeout(120.0, connect=10.0)
+# Every client created here shares these pools, so evicting a client never drops a connection
+_http_client = httpx.Client(limits=_limits, timeout=_timeout)
+_http_async_client = httpx.AsyncClient(limits=_limits, timeout=_timeout)
+
+
+class ClientRegistry:
+    """
+    Bounded, thread-safe LRU of API clients keyed by (provider, api_key, model).
+    """
+
+    def __init__(self, max_size=LLM_CLIENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+                while len(self._clients) > self.max_size:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(key)
+            return client
+
+
+registry = ClientRegistry()
+
+
+def get_groq_client(api_key):
+    """
+    OpenAI-compatible Groq client, used for the vision step and the Groq caption models.
+    """
+    return registry.get(
+        ("groq", api_key, None),
+        lambda: openai.OpenAI(base_url=GROQ_BASE_URL, api_key=api_key, http_client=_http_client)
+    )
+
+
+def get_chat_model(llm_type, api_key):
+    """
+    LangChain chat model for a caption llm_type listed in CHAT_MODELS.
+    """
+    provider, model = CHAT_MODELS[llm_type]
+
+    def create():
+        if provider == "openai":
+            return ChatOpenAI(model=model, api_key=api_key, http_client=_http_client, http_async_client=_http_async_client)
+        return ChatAnthropic(model=model, api_key=api_key)
+
+    return registry.get((provider, api_key, model), create)
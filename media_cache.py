@@ -0,0 +1,107 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Set MEDIA_CACHE_PATH to keep the cache in SQLite across restarts
+MEDIA_CACHE_PATH = os.environ.get("MEDIA_CACHE_PATH")
+MEDIA_CACHE_TTL = float(os.environ.get("MEDIA_CACHE_TTL", str(7 * 24 * 3600)))
+MEDIA_CACHE_MAX_ENTRIES = int(os.environ.get("MEDIA_CACHE_MAX_ENTRIES", "10000"))
+
+
+class MemoryCache:
+    """
+    Thread-safe LRU cache with a time-to-live, for values that are plain JSON.
+    """
+
+    def __init__(self, max_entries=MEDIA_CACHE_MAX_ENTRIES, ttl=MEDIA_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return json.loads(value)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (json.dumps(value), time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """
+    Same interface as MemoryCache, stored in a SQLite file so entries survive
+    restarts and can be shared by several workers on one machine.
+    """
+
+    def __init__(self, path, max_entries=MEDIA_CACHE_MAX_ENTRIES, ttl=MEDIA_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS media_cache_last_used ON media_cache (last_used)")
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM media_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now >= row[1]:
+                self._db.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE media_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO media_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now)
+            )
+            self._db.execute("DELETE FROM media_cache WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "DELETE FROM media_cache WHERE key IN ("
+                " SELECT key FROM media_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+
+def caption_key(upload_hash, llm_type, prompt_version, **options):
+    """
+    Key for a finished /analyze_media_and_gen_caption response. Every option that
+    changes which frames are described (is_video, interval, ...) is part of it.
+    """
+    option_text = ",".join(f"{name}={options[name]}" for name in sorted(options))
+    return f"caption:{llm_type}:{prompt_version}:{upload_hash}:{option_text}"
+
+
+cache = SQLiteCache(MEDIA_CACHE_PATH) if MEDIA_CACHE_PATH else MemoryCache()
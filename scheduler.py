@@ -0,0 +1,268 @@
+import asyncio
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCHEDULER_DB_PATH = os.environ.get("SCHEDULER_DB_PATH", "scheduled_posts.db")
+# How long before publish_at the media is uploaded and processed
+STAGE_AHEAD = float(os.environ.get("SCHEDULER_STAGE_AHEAD", "900"))
+# Posts a process is staging or publishing are marked alive this often; rows not marked
+# for three intervals were left behind by a process that died
+SCHEDULER_HEARTBEAT = float(os.environ.get("SCHEDULER_HEARTBEAT", "30"))
+
+# Statuses a post can no longer leave
+FINAL_STATUSES = ("published", "failed", "cancelled")
+
+
+class PostScheduler:
+    """
+    Publishes posts at their publish_at time from a single background task.
+
+    Posts are stored in SQLite and indexed in memory by a heap of
+    (due time, action, post id) events. The task sleeps until the earliest
+    event is due, or until a new post is scheduled, so it wakes exactly when
+    the next post needs attention. Each post has two events: "stage" runs
+    STAGE_AHEAD seconds early to do the slow work (uploads, media processing),
+    and "publish" runs at publish_at and only has to create the posts.
+
+    stage(payload) returns a JSON-serialisable dict of staged handles and
+    publish(payload, staged) returns the publish result; both are coroutine
+    functions supplied by the application.
+
+    Several processes (e.g. uvicorn workers) may share the database. Each step
+    is claimed with a conditional UPDATE, so only one process stages or
+    publishes a given post, and only rows whose heartbeat has gone stale are
+    recovered.
+    """
+
+    def __init__(self, path=SCHEDULER_DB_PATH, stage_ahead=STAGE_AHEAD, heartbeat=SCHEDULER_HEARTBEAT):
+        self.stage_ahead = stage_ahead
+        self.heartbeat = heartbeat
+        self._stage = None
+        self._publish = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS scheduled_posts ("
+            " id TEXT PRIMARY KEY, publish_at REAL NOT NULL, status TEXT NOT NULL,"
+            " payload TEXT NOT NULL, staged TEXT, result TEXT, error TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, heartbeat_at REAL)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(scheduled_posts)")]
+        if "heartbeat_at" not in columns:
+            self._db.execute("ALTER TABLE scheduled_posts ADD COLUMN heartbeat_at REAL")
+        self._db.commit()
+        self._events = []
+        self._staging = {}
+        self._active = set()
+        self._next_heartbeat = 0.0
+        self._tasks = set()
+        self._wakeup = None
+        self._runner = None
+
+    def configure(self, stage, publish):
+        self._stage = stage
+        self._publish = publish
+
+    def schedule(self, payload, publish_at):
+        """
+        Store a post to be published at publish_at (a Unix timestamp) and return its id.
+        """
+        post_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO scheduled_posts (id, publish_at, status, payload, created_at, updated_at)"
+                " VALUES (?, ?, 'scheduled', ?, ?, ?)",
+                (post_id, publish_at, json.dumps(payload), now, now)
+            )
+            self._db.commit()
+        self._push(post_id, publish_at, staged=False)
+        return post_id
+
+    def get(self, post_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, publish_at, status, payload, staged, result, error FROM scheduled_posts WHERE id = ?",
+                (post_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "publish_at": row[1],
+            "status": row[2],
+            "payload": json.loads(row[3]),
+            "staged": json.loads(row[4]) if row[4] else None,
+            "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+        }
+
+    def cancel(self, post_id):
+        """
+        Cancel a post that has not started publishing. Returns False if it is too late.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE scheduled_posts SET status = 'cancelled', updated_at = ?"
+                " WHERE id = ? AND status IN ('scheduled', 'staging', 'staged')",
+                (time.time(), post_id)
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._recover()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, publish_at, status FROM scheduled_posts WHERE status IN ('scheduled', 'staging', 'staged')"
+            ).fetchall()
+        for post_id, publish_at, status in rows:
+            self._push(post_id, publish_at, staged=status != 'scheduled')
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [self._runner, *self._tasks] if self._runner else list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._runner = None
+
+    def _push(self, post_id, publish_at, staged):
+        if not staged:
+            heapq.heappush(self._events, (publish_at - self.stage_ahead, "stage", post_id))
+        heapq.heappush(self._events, (publish_at, "publish", post_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _update(self, post_id, only_if=None, **fields):
+        """
+        Set fields on a post, only while its status is only_if when given.
+        Returns True if the row was updated.
+        """
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        condition = " AND status = ?" if only_if else ""
+        with self._lock:
+            cursor = self._db.execute(
+                f"UPDATE scheduled_posts SET {columns}, updated_at = ? WHERE id = ?{condition}",
+                (*fields.values(), time.time(), post_id, *([only_if] if only_if else []))
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def _claim(self, post_id, from_statuses, to_status):
+        # A single conditional UPDATE is atomic across every process sharing the database
+        placeholders = ",".join("?" * len(from_statuses))
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE scheduled_posts SET status = ?, heartbeat_at = ?, updated_at = ?"
+                f" WHERE id = ? AND status IN ({placeholders})",
+                (to_status, now, now, post_id, *from_statuses)
+            )
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def _recover(self):
+        stale = time.time() - 3 * self.heartbeat
+        with self._lock:
+            # A post caught mid-publish by a crash may already be live, so it is not retried
+            self._db.execute(
+                "UPDATE scheduled_posts SET status = 'failed', error = 'Interrupted by a restart'"
+                " WHERE status = 'publishing' AND COALESCE(heartbeat_at, updated_at) < ?",
+                (stale,)
+            )
+            # Staging only prepares media, so it can simply be done again or skipped
+            self._db.execute(
+                "UPDATE scheduled_posts SET status = 'scheduled'"
+                " WHERE status = 'staging' AND COALESCE(heartbeat_at, updated_at) < ?",
+                (stale,)
+            )
+            self._db.commit()
+
+    def _beat(self):
+        if self._active:
+            ids = list(self._active)
+            with self._lock:
+                self._db.execute(
+                    f"UPDATE scheduled_posts SET heartbeat_at = ? WHERE id IN ({','.join('?' * len(ids))})",
+                    (time.time(), *ids)
+                )
+                self._db.commit()
+        self._recover()
+        self._next_heartbeat = time.time() + self.heartbeat
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if time.time() >= self._next_heartbeat:
+                self._beat()
+            while self._events and self._events[0][0] <= time.time():
+                _, action, post_id = heapq.heappop(self._events)
+                if action == "stage":
+                    self._staging[post_id] = self._spawn(self._stage_post(post_id))
+                else:
+                    self._spawn(self._publish_post(post_id))
+
+            next_wake = min(self._events[0][0], self._next_heartbeat) if self._events else self._next_heartbeat
+            timeout = max(0.0, next_wake - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _stage_post(self, post_id):
+        if not self._claim(post_id, ("scheduled",), "staging"):
+            return None
+        self._active.add(post_id)
+        try:
+            staged = await self._stage(self.get(post_id)["payload"])
+        except Exception as e:
+            # Publishing still goes ahead, just without the head start
+            print(f"Staging scheduled post {post_id} failed:", e)
+            self._update(post_id, only_if="staging", status="scheduled")
+            return None
+        finally:
+            self._active.discard(post_id)
+        # Publishing may already have started (in another process) without waiting for this
+        self._update(post_id, only_if="staging", status="staged", staged=json.dumps(staged))
+        return staged
+
+    async def _publish_post(self, post_id):
+        staging = self._staging.pop(post_id, None)
+        staged = await staging if staging is not None else None
+        # Every process holding this post tries to claim it; only one wins
+        if not self._claim(post_id, ("scheduled", "staging", "staged"), "publishing"):
+            return
+        post = self.get(post_id)
+        if staged is None:
+            staged = post["staged"] or {}
+
+        self._active.add(post_id)
+        try:
+            result = await self._publish(post["payload"], staged)
+        except Exception as e:
+            print(f"Publishing scheduled post {post_id} failed:", e)
+            self._update(post_id, status="failed", error=str(e))
+        else:
+            self._update(post_id, status="published", result=json.dumps(result))
+        finally:
+            self._active.discard(post_id)
+
+
+post_scheduler = PostScheduler()
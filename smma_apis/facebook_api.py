@@ -1,41 +1,67 @@
-import requests
-import os 
-import time
+import httpx
+import os
 from dotenv import load_dotenv
+from smma_apis import http_client
+from smma_apis import status_poller
+from smma_apis import token_cache
+from smma_apis.http_client import GRAPH_API_BASE
 
 load_dotenv()
 
-def get_page_access_token(page_id, user_access_token):
+def _is_auth_error(response):
+    # The Graph API reports expired or revoked tokens as OAuth error 190
+    if response.status_code == 401:
+        return True
+    try:
+        return response.json().get('error', {}).get('code') == 190
+    except ValueError:
+        return False
+
+async def get_page_access_token(page_id, user_access_token):
     """
     Function to retrieve the Page Access Token using the user access token and page ID.
     """
     version = 'v20.0'
-    api_url_token = f'https://graph.facebook.com/{version}/{page_id}?fields=access_token&access_token={user_access_token}'
-    
+    api_url_token = f'{GRAPH_API_BASE}/{version}/{page_id}'
+
     try:
-        response = requests.get(api_url_token)
+        response = await http_client.request(
+            "GET", api_url_token,
+            params={'fields': 'access_token', 'access_token': user_access_token},
+            platform="facebook", account=page_id
+        )
         response.raise_for_status()
         data = response.json()
         return data['access_token']
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print("Error retrieving Page Access Token:", e)
         return None
 
-def post_fb(page_id, page_access_token, message, media_url=None, media_type='image'):
+async def get_cached_page_access_token(page_id, user_access_token):
+    """
+    Same as get_page_access_token, but reuses the token across requests until it
+    expires from the cache or the Graph API rejects it.
+    """
+    return await token_cache.facebook_page_tokens.get(
+        (page_id, user_access_token),
+        lambda: get_page_access_token(page_id, user_access_token)
+    )
+
+async def post_fb(page_id, page_access_token, message, media_url=None, media_type='image'):
     """
     Function to publish a post to the Facebook Page using the Page Access Token.
     Supports text, image, and video posts.
     """
     if media_url:
         if media_type == 'image':
-            url = f'https://graph.facebook.com/v20.0/{page_id}/photos'
+            url = f'{GRAPH_API_BASE}/v20.0/{page_id}/photos'
             payload = {
                 'message': message,
                 'url': media_url,
                 'access_token': page_access_token
             }
         elif media_type == 'video':
-            url = f'https://graph.facebook.com/v20.0/{page_id}/videos'
+            url = f'{GRAPH_API_BASE}/v20.0/{page_id}/videos'
             payload = {
                 'description': message,
                 'file_url': media_url,
@@ -45,46 +71,45 @@ def post_fb(page_id, page_access_token, message, media_url=None, media_type='ima
             print("Error: Invalid media type. Use 'image' or 'video'.")
             return None
     else:
-        url = f'https://graph.facebook.com/v20.0/{page_id}/feed'
+        url = f'{GRAPH_API_BASE}/v20.0/{page_id}/feed'
         payload = {
             'message': message,
             'access_token': page_access_token
         }
-    
+
     try:
-        response = requests.post(url, data=payload)
+        response = await http_client.request("POST", url, data=payload, platform="facebook", account=page_id)
         response.raise_for_status()
         response_json = response.json()
-        
+
         if media_type == 'video':
             video_id = response_json.get('id')
             if video_id:
-                status_url = f"https://graph.facebook.com/v20.0/{video_id}?fields=status&access_token={page_access_token}"
-                while True:
-                    status_response = requests.get(status_url)
-                    status_json = status_response.json()
-                    if status_json.get('status', {}).get('video_status') == 'ready':
-                        print("Video processing completed.")
-                        break
-                    elif status_json.get('status', {}).get('video_status') == 'error':
-                        print("Error processing video:")
-                        print(status_json)
-                        return None
-                    print("Video still processing. Waiting...")
-                    time.sleep(5)
-        
+                try:
+                    await status_poller.wait_for_facebook_video(video_id, page_access_token, page_id)
+                    print("Video processing completed.")
+                except status_poller.VideoProcessingError as e:
+                    print("Error processing video:")
+                    print(e.status)
+                    return None
+                except TimeoutError as e:
+                    print("Error processing video:", e)
+                    return None
+
         print("Post successfully published!")
         return response_json
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Failed to post: {e}")
-        if response:
-            print(response.json())
+        if isinstance(e, httpx.HTTPStatusError):
+            print(e.response.text)
+            if _is_auth_error(e.response):
+                token_cache.facebook_page_tokens.discard_value(page_access_token)
         return None
 
 
 # user_access_token = os.environ.get("FACEBOOK_USER_ACCESS_TOKEN")
 # page_id = os.environ.get("FACEBOOK_PAGE_ID")
-    
-# page_access_token = get_page_access_token(page_id, user_access_token) 
+
+# page_access_token = asyncio.run(get_page_access_token(page_id, user_access_token))
 
 
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from smma_apis.status_poller import VIDEO_PROCESSING_TIMEOUT
+
+load_dotenv()
+
+# Seconds each platform gets before /post/all gives up on it
+DEFAULT_PLATFORM_TIMEOUT = float(os.environ.get("POST_ALL_PLATFORM_TIMEOUT", "120"))
+# Video posts wait for the platform to finish processing, so they get the processing
+# ceiling plus time for the upload and the publish call
+VIDEO_PLATFORM_TIMEOUT = float(os.environ.get("POST_ALL_VIDEO_TIMEOUT", str(VIDEO_PROCESSING_TIMEOUT + 300)))
+
+
+def platform_timeout(media_type):
+    """
+    Deadline for each platform when publishing media of media_type.
+    """
+    return VIDEO_PLATFORM_TIMEOUT if media_type == "video" else DEFAULT_PLATFORM_TIMEOUT
+
+
+async def _publish_one(platform, publish, timeout):
+    """
+    Run a single platform publisher under its deadline and describe the outcome.
+    Publishers follow the endpoint convention: they return {"message": ...} on
+    success and {"error": ...} on failure, or raise.
+    """
+    started = time.monotonic()
+    try:
+        outcome = await asyncio.wait_for(publish(), timeout)
+    except asyncio.TimeoutError:
+        status, detail = "timeout", f"{platform} did not finish within {timeout:g}s"
+    except Exception as e:
+        status, detail = "error", str(e)
+    else:
+        if isinstance(outcome, dict) and "error" in outcome:
+            status, detail = "error", outcome["error"]
+        else:
+            status = "success"
+            detail = outcome.get("message") if isinstance(outcome, dict) else outcome
+
+    return {
+        "status": status,
+        "detail": detail,
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+    }
+
+
+async def fan_out(publishers, timeouts=None, default_timeout=DEFAULT_PLATFORM_TIMEOUT):
+    """
+    Run every publisher at the same time and collect one result per platform.
+
+    publishers maps a platform name to a zero-argument callable returning an
+    awaitable. timeouts optionally overrides the deadline for individual
+    platforms. A platform that fails or times out never affects the others, so
+    the total latency is that of the slowest platform rather than the sum.
+    """
+    timeouts = timeouts or {}
+    platforms = list(publishers)
+    results = await asyncio.gather(*(
+        _publish_one(platform, publishers[platform], timeouts.get(platform, default_timeout))
+        for platform in platforms
+    ))
+    return dict(zip(platforms, results))
@@ -0,0 +1,62 @@
+import os
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+from smma_apis import rate_limit
+
+load_dotenv()
+
+# Base URLs are configurable so the clients can be pointed at a local fake server
+GRAPH_API_BASE = os.environ.get("GRAPH_API_BASE", "https://graph.facebook.com").rstrip("/")
+LINKEDIN_API_BASE = os.environ.get("LINKEDIN_API_BASE", "https://api.linkedin.com").rstrip("/")
+
+# Uploads and media downloads can take a while, so only connecting is kept short
+HTTP_TIMEOUT = httpx.Timeout(float(os.environ.get("HTTP_TIMEOUT", "300")), connect=10.0)
+HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "20")),
+    max_keepalive_connections=int(os.environ.get("HTTP_MAX_KEEPALIVE_PER_HOST", "10")),
+    keepalive_expiry=30.0,
+)
+
+# One keep-alive connection pool per scheme://host
+_clients = {}
+
+
+def get_client(url):
+    """
+    Return the shared AsyncClient for the host of url, creating it on first use.
+    """
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    client = _clients.get(origin)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, follow_redirects=True)
+        _clients[origin] = client
+    return client
+
+
+async def request(method, url, platform=None, account=None, retries=rate_limit.RATE_LIMIT_MAX_RETRIES, **kwargs):
+    """
+    Send a request through the pooled client for url's host.
+    Accepts the same keyword arguments as httpx.AsyncClient.request.
+
+    With a platform, the request waits for that platform/account's rate limiter
+    and is queued again after a 429, up to `retries` times. Pass retries=0 for
+    bodies that can only be sent once, such as streamed uploads.
+    """
+    client = get_client(url)
+    if platform is None:
+        return await client.request(method, url, **kwargs)
+    return await rate_limit.send_with_limits(
+        platform, account, lambda: client.request(method, url, **kwargs), retries
+    )
+
+
+async def close_clients():
+    """
+    Close every pooled client. Called when the application shuts down.
+    """
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
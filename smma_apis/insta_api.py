@@ -1,19 +1,31 @@
-import requests
 import os
-import time
 from dotenv import load_dotenv
+from smma_apis import http_client
+from smma_apis import status_poller
+from smma_apis.http_client import GRAPH_API_BASE
 load_dotenv()
 
-def post_to_instagram(caption, media_url, media_type='image'):
+def _credentials():
     IG_ACCESS_TOKEN = os.environ.get("IG_ACCESS_TOKEN")
     IG_ID = os.environ.get("IG_ID")
 
     if not IG_ACCESS_TOKEN or not IG_ID:
         print("Error: Instagram access token or user ID not found in environment variables.")
-        return
+        return None, None
+    return IG_ACCESS_TOKEN, IG_ID
+
+async def create_container(caption, media_url, media_type='image'):
+    """
+    Create the media container and wait until Instagram has processed it.
+    Returns the container id, which can be published with publish_container
+    (Instagram keeps unpublished containers for 24 hours), or None on failure.
+    """
+    IG_ACCESS_TOKEN, IG_ID = _credentials()
+    if not IG_ACCESS_TOKEN:
+        return None
 
     # Step 1: Create media container
-    create_media_url = f"https://graph.facebook.com/v18.0/{IG_ID}/media"
+    create_media_url = f"{GRAPH_API_BASE}/v18.0/{IG_ID}/media"
     media_payload = {
         "caption": caption,
         "access_token": IG_ACCESS_TOKEN
@@ -26,49 +38,64 @@ def post_to_instagram(caption, media_url, media_type='image'):
         media_payload["video_url"] = media_url
     else:
         print("Error: Invalid media type. Use 'image' or 'video'.")
-        return
+        return None
 
-    response = requests.post(create_media_url, data=media_payload)
+    response = await http_client.request("POST", create_media_url, data=media_payload, platform="instagram", account=IG_ID)
     response_json = response.json()
 
-    if 'id' in response_json:
-        media_id = response_json['id']
-        print(f"Media container created successfully. ID: {media_id}")
-
-        # Step 2: Check status for video uploads
-        if media_type == 'video':
-            status_url = f"https://graph.facebook.com/v18.0/{media_id}?fields=status_code&access_token={IG_ACCESS_TOKEN}"
-            while True:
-                status_response = requests.get(status_url)
-                status_json = status_response.json()
-                if status_json.get('status_code') == 'FINISHED':
-                    print("Video processing completed.")
-                    break
-                elif status_json.get('status_code') == 'ERROR':
-                    print("Error processing video:")
-                    print(status_json)
-                    return
-                print("Video still processing. Waiting...")
-                time.sleep(5)
-
-        # Step 3: Publish media
-        publish_url = f"https://graph.facebook.com/v18.0/{IG_ID}/media_publish"
-        publish_payload = {
-            "creation_id": media_id,
-            "access_token": IG_ACCESS_TOKEN
-        }
-        publish_response = requests.post(publish_url, data=publish_payload)
-        publish_json = publish_response.json()
-        
-        if 'id' in publish_json:
-            print(f"Post published successfully. Post ID: {publish_json['id']}")
-        else:
-            print("Error publishing post:")
-            print(publish_json)
-    else:
+    if 'id' not in response_json:
         print("Error creating media container:")
         print(response_json)
+        return None
+
+    media_id = response_json['id']
+    print(f"Media container created successfully. ID: {media_id}")
+
+    # Step 2: Check status for video uploads
+    if media_type == 'video':
+        try:
+            await status_poller.wait_for_instagram_container(media_id, IG_ACCESS_TOKEN, IG_ID)
+            print("Video processing completed.")
+        except status_poller.VideoProcessingError as e:
+            print("Error processing video:")
+            print(e.status)
+            return None
+        except TimeoutError as e:
+            print("Error processing video:", e)
+            return None
+
+    return media_id
+
+async def publish_container(media_id):
+    """
+    Publish a container made by create_container. Returns the post id, or None on failure.
+    """
+    IG_ACCESS_TOKEN, IG_ID = _credentials()
+    if not IG_ACCESS_TOKEN:
+        return None
+
+    # Step 3: Publish media
+    publish_url = f"{GRAPH_API_BASE}/v18.0/{IG_ID}/media_publish"
+    publish_payload = {
+        "creation_id": media_id,
+        "access_token": IG_ACCESS_TOKEN
+    }
+    publish_response = await http_client.request("POST", publish_url, data=publish_payload, platform="instagram", account=IG_ID)
+    publish_json = publish_response.json()
+
+    if 'id' in publish_json:
+        print(f"Post published successfully. Post ID: {publish_json['id']}")
+        return publish_json['id']
+    print("Error publishing post:")
+    print(publish_json)
+    return None
+
+async def post_to_instagram(caption, media_url, media_type='image'):
+    media_id = await create_container(caption, media_url, media_type)
+    if media_id:
+        return await publish_container(media_id)
+    return None
 
 # Example usage (commented out)
-# post_to_instagram("Check out this cool image!", "https://example.com/image.jpg", "image")
-# post_to_instagram("Check out this awesome video!", "https://example.com/video.mp4", "video")
+# asyncio.run(post_to_instagram("Check out this cool image!", "https://example.com/image.jpg", "image"))
+# asyncio.run(post_to_instagram("Check out this awesome video!", "https://example.com/video.mp4", "video"))
@@ -1,32 +1,56 @@
-import requests
+import asyncio
 import json
 import os
-import time
 from dotenv import load_dotenv
+from smma_apis import http_client
+from smma_apis import rate_limit
+from smma_apis import token_cache
+from smma_apis.http_client import LINKEDIN_API_BASE
 
 load_dotenv()
 
+# Upper bound on how long to wait for an uploaded asset to become AVAILABLE
+ASSET_READY_TIMEOUT = float(os.environ.get("LINKEDIN_ASSET_READY_TIMEOUT", "120"))
+
+# Size of each piece read from the media source while streaming an upload
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+async def _read_chunks(media_file):
+    # File reads happen on a worker thread so the event loop keeps serving requests
+    while True:
+        chunk = await asyncio.to_thread(media_file.read, UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
 class LinkedinAutomate:
-    def __init__(self, access_token, media_url, title, description, media_type='image'):
+    def __init__(self, access_token, media_url, title, description, media_type='image', ready_timeout=ASSET_READY_TIMEOUT):
         self.access_token = access_token
         self.media_url = media_url
         self.title = title
         self.description = description
         self.media_type = media_type
+        self.ready_timeout = ready_timeout
+        self.account = rate_limit.account_id(access_token)
         self.headers = {
             'Authorization': f'Bearer {self.access_token}',
             'Content-Type': 'application/json',
         }
 
-    def get_user_id(self):
-        url = "https://api.linkedin.com/v2/userinfo"
-        response = requests.get(url, headers=self.headers)
+    async def get_user_id(self):
+        url = f"{LINKEDIN_API_BASE}/v2/userinfo"
+        response = await http_client.request("GET", url, headers=self.headers, platform="linkedin", account=self.account)
         jsonData = response.json()
         print("JSONDATA: ", jsonData)
         return jsonData["sub"]
 
-    def register_upload(self):
-        url = "https://api.linkedin.com/v2/assets?action=registerUpload"
+    def _check_auth(self, response):
+        # A rejected token means the cached user id can no longer be trusted
+        if response.status_code == 401:
+            token_cache.linkedin_user_ids.invalidate(self.access_token)
+
+    async def register_upload(self):
+        url = f"{LINKEDIN_API_BASE}/v2/assets?action=registerUpload"
         payload = {
             "registerUploadRequest": {
                 "recipes": [f"urn:li:digitalmediaRecipe:feedshare-{self.media_type}"],
@@ -39,7 +63,8 @@ class LinkedinAutomate:
                 ]
             }
         }
-        response = requests.post(url, json=payload, headers=self.headers)
+        response = await http_client.request("POST", url, json=payload, headers=self.headers, platform="linkedin", account=self.account)
+        self._check_auth(response)
         if response.status_code == 200:
             data = response.json()
             return data["value"]["uploadMechanism"]["com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest"]["uploadUrl"], data["value"]["asset"]
@@ -47,36 +72,80 @@ class LinkedinAutomate:
             print("Error registering upload:", response.text)
             return None, None
 
-    def upload_media(self, upload_url):
-        headers = {'Authorization': f'Bearer {self.access_token}'}
-        
+    async def upload_media(self, upload_url):
+        """
+        Stream the media straight from its source (URL or local file) into the
+        upload URL, one chunk at a time, so memory use does not grow with file size.
+        """
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/octet-stream',
+        }
+
         if self.media_url.startswith(('http://', 'https://')):
-            # If it's a URL, download the media first
-            response = requests.get(self.media_url)
-            if response.status_code == 200:
-                media_content = response.content
-            else:
-                print(f"Error downloading media from URL: {response.status_code}")
-                return False
+            # If it's a URL, pipe the download into the upload as it arrives
+            async with http_client.get_client(self.media_url).stream("GET", self.media_url) as source:
+                if source.status_code != 200:
+                    print(f"Error downloading media from URL: {source.status_code}")
+                    return False
+                # The length is only meaningful when the body is not content-encoded
+                if 'Content-Length' in source.headers and 'Content-Encoding' not in source.headers:
+                    headers['Content-Length'] = source.headers['Content-Length']
+                # A streamed body can only be sent once, so a 429 here is not retried
+                response = await http_client.request(
+                    "PUT", upload_url, content=source.aiter_bytes(UPLOAD_CHUNK_SIZE), headers=headers,
+                    platform="linkedin", account=self.account, retries=0
+                )
         else:
             # If it's a local file path
             try:
-                with open(self.media_url, 'rb') as media_file:
-                    media_content = media_file.read()
+                media_file = open(self.media_url, 'rb')
             except IOError as e:
                 print(f"Error reading local media file: {e}")
                 return False
+            with media_file:
+                headers['Content-Length'] = str(os.fstat(media_file.fileno()).st_size)
+                response = await http_client.request(
+                    "PUT", upload_url, content=_read_chunks(media_file), headers=headers,
+                    platform="linkedin", account=self.account, retries=0
+                )
 
-        files = {'file': (f'media.{self.media_type}', media_content, f'{self.media_type}/{self.media_type}')}
-        response = requests.post(upload_url, files=files, headers=headers)
-        
-        if response.status_code != 201:
+        if response.status_code not in (200, 201):
             print(f"Error uploading {self.media_type}:", response.text)
             return False
         return True
 
-    def create_post(self, asset):
-        url = "https://api.linkedin.com/v2/ugcPosts"
+    async def wait_for_asset(self, asset):
+        """
+        Poll the registered asset until LinkedIn reports it AVAILABLE.
+        Returns True when the asset can be posted and False if processing failed
+        or did not finish within ready_timeout seconds.
+        """
+        asset_id = asset.split(":")[-1]
+        url = f"{LINKEDIN_API_BASE}/v2/assets/{asset_id}"
+        deadline = asyncio.get_running_loop().time() + self.ready_timeout
+        delay = 0.25
+        while True:
+            response = await http_client.request("GET", url, headers=self.headers, platform="linkedin", account=self.account)
+            if response.status_code == 200:
+                statuses = [recipe.get("status") for recipe in response.json().get("recipes", [])]
+                if statuses and all(status == "AVAILABLE" for status in statuses):
+                    return True
+                if any(status in ("PROCESSING_FAILED", "CLIENT_ERROR") for status in statuses):
+                    print("Error processing asset:", response.text)
+                    return False
+            else:
+                print("Error checking asset status:", response.text)
+
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                print(f"Asset {asset} was not ready after {self.ready_timeout:g} seconds")
+                return False
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5.0)
+
+    async def create_post(self, asset):
+        url = f"{LINKEDIN_API_BASE}/v2/ugcPosts"
         payload = {
             "author": f"urn:li:person:{self.user_id}",
             "lifecycleState": "PUBLISHED",
@@ -104,27 +173,48 @@ class LinkedinAutomate:
                 "com.linkedin.ugc.MemberNetworkVisibility": "PUBLIC"
             }
         }
-        response = requests.post(url, json=payload, headers=self.headers)
+        response = await http_client.request("POST", url, json=payload, headers=self.headers, platform="linkedin", account=self.account)
+        self._check_auth(response)
+        if response.is_error:
+            print("Failed to create post:", response.text)
+            return None
         return response.json()
 
-    def main_func(self):
-        self.user_id = self.get_user_id()
+    async def prepare_media(self):
+        """
+        Register, upload and wait for the media. Returns the asset URN, which
+        publish() can turn into a post later, or None on failure.
+        """
+        self.user_id = await token_cache.linkedin_user_ids.get(self.access_token, self.get_user_id)
         print("User ID:", self.user_id)
 
-        upload_url, asset = self.register_upload()
+        upload_url, asset = await self.register_upload()
         if not upload_url or not asset:
-            return
+            return None
 
-        if self.upload_media(upload_url):
-            print(f"{self.media_type.capitalize()} uploaded successfully")
-            
-            # Wait for the media to be processed
-            time.sleep(10)  # You might need to adjust this waiting time
-
-            post_response = self.create_post(asset)
-            print("Post response:", post_response)
-        else:
+        if not await self.upload_media(upload_url):
             print(f"Failed to upload {self.media_type}")
+            return None
+        print(f"{self.media_type.capitalize()} uploaded successfully")
+
+        # Wait for the media to be processed
+        if not await self.wait_for_asset(asset):
+            return None
+        return asset
+
+    async def publish(self, asset):
+        """
+        Create the post for an asset returned by prepare_media.
+        """
+        self.user_id = await token_cache.linkedin_user_ids.get(self.access_token, self.get_user_id)
+        post_response = await self.create_post(asset)
+        print("Post response:", post_response)
+        return post_response
+
+    async def main_func(self):
+        asset = await self.prepare_media()
+        if asset:
+            return await self.publish(asset)
 
 # if __name__ == "__main__":
 #     access_token = os.getenv('LINKEDIN_ACCESS_TOKEN')
@@ -134,11 +224,11 @@ class LinkedinAutomate:
     # image_title = "My Image Post"
     # image_description = "Check out this awesome image!"
     # linkedin_image = LinkedinAutomate(access_token, image_url, image_title, image_description, media_type='image')
-    # linkedin_image.main_func()
+    # asyncio.run(linkedin_image.main_func())
 
     # Example for video upload
     # video_url = "C:/Users/Siddhant Dawande/OneDrive/Desktop/MY BRAIN/UPWORK/social_media_script/media_for_twitter/Recording 2025-01-18 230252.mp4"  # Replace with the actual path to your video file
     # video_title = "My Video Post"
     # video_description = "Check out this awesome video!"
     # linkedin_video = LinkedinAutomate(access_token, video_url, video_title, video_description, media_type='video')
-    # linkedin_video.main_func()
+    # asyncio.run(linkedin_video.main_func())
@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MEDIA_HANDLES_DB_PATH = os.environ.get("MEDIA_HANDLES_DB_PATH", "media_handles.db")
+# Instagram containers and X media ids expire after 24 hours, so handles expire a little earlier
+MEDIA_HANDLE_TTL = float(os.environ.get("MEDIA_HANDLE_TTL", str(23 * 3600)))
+
+
+class MediaHandleStore:
+    """
+    Store of prepared media: the Drive link, LinkedIn asset, X media id and
+    Instagram containers created by a prepare call, kept under a random handle
+    until they expire so that publishing only has to create the posts.
+
+    Handles are stored in SQLite, so a handle prepared by one process (e.g. a
+    uvicorn worker) can be published or discarded by any other.
+    """
+
+    def __init__(self, path=MEDIA_HANDLES_DB_PATH, ttl=MEDIA_HANDLE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media_handles ("
+            " handle TEXT PRIMARY KEY, media_url TEXT NOT NULL, media_type TEXT NOT NULL,"
+            " platforms TEXT NOT NULL, staged TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def add(self, media_url, media_type, platforms, staged):
+        handle = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM media_handles WHERE expires_at <= ?", (now,))
+            self._db.execute(
+                "INSERT INTO media_handles (handle, media_url, media_type, platforms, staged, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (handle, media_url, media_type, json.dumps(list(platforms)), json.dumps(staged), now + self.ttl)
+            )
+            self._db.commit()
+        return handle
+
+    def get(self, handle):
+        """
+        Return the prepared media for handle, or None when it is unknown or has expired.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT media_url, media_type, platforms, staged, expires_at FROM media_handles"
+                " WHERE handle = ? AND expires_at > ?",
+                (handle, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        media_url, media_type, platforms, staged, expires_at = row
+        return {
+            "media_url": media_url,
+            "media_type": media_type,
+            "platforms": json.loads(platforms),
+            "staged": json.loads(staged),
+            "expires_at": expires_at,
+        }
+
+    def take_instagram_container(self, handle, caption):
+        """
+        Remove and return the Instagram container staged for caption, or None.
+        A container can only be published once, so each is handed out to a
+        single caller even when several processes publish the same handle.
+        """
+        with self._lock:
+            # Take the write lock before reading so no other process can take the same container
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT staged FROM media_handles WHERE handle = ? AND expires_at > ?",
+                    (handle, time.time())
+                ).fetchone()
+                container = None
+                if row is not None:
+                    staged = json.loads(row[0])
+                    container = staged.get("instagram_containers", {}).pop(caption, None)
+                    if container is not None:
+                        self._db.execute(
+                            "UPDATE media_handles SET staged = ? WHERE handle = ?", (json.dumps(staged), handle)
+                        )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        return container
+
+    def discard(self, handle):
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM media_handles WHERE handle = ? AND expires_at > ?", (handle, time.time())
+            )
+            self._db.commit()
+        return cursor.rowcount > 0
+
+
+media_handles = MediaHandleStore()
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Sustained requests per second and burst size for each platform and account.
+# Override with e.g. RATE_LIMIT_FACEBOOK="2/10".
+DEFAULT_LIMITS = {
+    "facebook": (3.0, 20),
+    "instagram": (1.0, 10),
+    "linkedin": (1.0, 10),
+    "twitter": (0.5, 5),
+    "groq": (0.5, 5),
+}
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "5"))
+RATE_LIMIT_MAX_DELAY = float(os.environ.get("RATE_LIMIT_MAX_DELAY", "300"))
+
+
+class TokenBucket:
+    """
+    Token bucket that queues callers instead of rejecting them: each caller
+    reserves a token and is told how long to wait for it, so bursts are spread
+    out at the configured rate. A rate-limit response can also pause the
+    bucket until the platform's window resets.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return how many seconds to wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + min(seconds, RATE_LIMIT_MAX_DELAY))
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def account_id(secret):
+    """
+    Stable short id for an access token or API key, so secrets are not used as keys.
+    """
+    return hashlib.sha256(str(secret).encode()).hexdigest()[:16]
+
+
+def get_bucket(platform, account=None):
+    key = (platform, account)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            override = os.environ.get(f"RATE_LIMIT_{platform.upper()}")
+            if override:
+                rate, capacity = override.split("/")
+                bucket = TokenBucket(float(rate), int(capacity))
+            else:
+                bucket = TokenBucket(*DEFAULT_LIMITS.get(platform, (1.0, 5)))
+            _buckets[key] = bucket
+        return bucket
+
+
+def _parse_duration(value):
+    # Groq reports resets as durations such as "2m59.56s" or "7.66s"
+    match = re.fullmatch(r"(?:(\d+(?:\.\d+)?)h)?(?:(\d+(?:\.\d+)?)m(?!s))?(?:(\d+(?:\.\d+)?)s)?(?:(\d+(?:\.\d+)?)ms)?", value.strip())
+    if not match or not any(match.groups()):
+        return None
+    hours, minutes, seconds, millis = (float(group) if group else 0.0 for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds + millis / 1000
+
+
+def delay_from_headers(headers):
+    """
+    Seconds to hold off according to the rate-limit headers of a response, or
+    None when the headers do not ask for a pause. Understands Retry-After, X's
+    x-rate-limit-*, Groq's x-ratelimit-*, and the Graph API usage headers.
+    """
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    if headers.get("x-rate-limit-remaining") == "0" and headers.get("x-rate-limit-reset"):
+        return max(0.0, float(headers["x-rate-limit-reset"]) - time.time())
+
+    for kind in ("requests", "tokens"):
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+            delay = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}", ""))
+            if delay is not None:
+                return delay
+
+    for name in ("x-app-usage", "x-business-use-case-usage"):
+        if name not in headers:
+            continue
+        try:
+            usage = json.loads(headers[name])
+        except ValueError:
+            continue
+        # x-app-usage is one dict; business use case usage is {business_id: [dict, ...]}
+        entries = [usage] if name == "x-app-usage" else [entry for group in usage.values() for entry in group]
+        for entry in entries:
+            if max(entry.get("call_count", 0), entry.get("total_time", 0), entry.get("total_cputime", 0)) >= 95:
+                return float(entry.get("estimated_time_to_regain_access", 1)) * 60 or 60.0
+    return None
+
+
+def backoff_delay(attempt):
+    return min(RATE_LIMIT_MAX_DELAY, 2 ** attempt) + random.uniform(0, 1)
+
+
+async def send_with_limits(platform, account, send, retries=RATE_LIMIT_MAX_RETRIES):
+    """
+    Wait for a token, call the coroutine function send() and return its
+    response. A 429 pauses the bucket (using the response's headers when they
+    say how long) and the request is queued again, up to `retries` times.
+    """
+    bucket = get_bucket(platform, account)
+    attempt = 0
+    while True:
+        await bucket.acquire()
+        response = await send()
+        delay = delay_from_headers(response.headers)
+        if response.status_code == 429 and attempt < retries:
+            bucket.pause(delay if delay is not None else backoff_delay(attempt))
+            attempt += 1
+            continue
+        if delay:
+            bucket.pause(delay)
+        return response
+
+
+def call_with_limits(platform, account, call, rate_limit_headers, retries=RATE_LIMIT_MAX_RETRIES):
+    """
+    Blocking counterpart of send_with_limits for SDK calls (tweepy, openai)
+    that raise on a 429. rate_limit_headers(error) returns the response
+    headers when error is a rate-limit error and None for any other error.
+    """
+    bucket = get_bucket(platform, account)
+    attempt = 0
+    while True:
+        bucket.acquire_sync()
+        try:
+            return call()
+        except Exception as e:
+            headers = rate_limit_headers(e)
+            if headers is None or attempt >= retries:
+                raise
+            delay = delay_from_headers(headers)
+            bucket.pause(delay if delay is not None else backoff_delay(attempt))
+            attempt += 1
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+from smma_apis import http_client
+from smma_apis.http_client import GRAPH_API_BASE
+
+load_dotenv()
+
+# Hard ceiling on how long a single video may stay in processing
+VIDEO_PROCESSING_TIMEOUT = float(os.environ.get("VIDEO_PROCESSING_TIMEOUT", "900"))
+# The Graph API accepts up to 50 ids in one ?ids= lookup
+GRAPH_BATCH_SIZE = 50
+
+
+class VideoProcessingError(Exception):
+    """
+    Raised through the watch() future when the platform reports that processing failed.
+    """
+    def __init__(self, object_id, status):
+        super().__init__(f"Processing failed for {object_id}: {status}")
+        self.object_id = object_id
+        self.status = status
+
+
+class _Pending:
+    def __init__(self, object_id, access_token, platform, account, version, field, classify, future, timeout, delay):
+        self.object_id = object_id
+        self.group = (platform, account, version, field, access_token)
+        self.classify = classify
+        self.future = future
+        self.deadline = time.monotonic() + timeout
+        self.delay = delay
+        self.next_check = time.monotonic() + delay
+
+
+class StatusPoller:
+    """
+    Tracks Graph API objects that are still processing (Facebook videos, Instagram
+    reel containers) from a single background task.
+
+    Every due object that shares an API version, status field and access token is
+    checked in one ?ids= request. Objects that are still processing are checked
+    again with exponential backoff, and each one fails with TimeoutError once its
+    hard timeout passes. watch() returns a future, so any number of videos can be
+    waiting at once without tying up a request handler each.
+    """
+
+    def __init__(self, initial_delay=2.0, max_delay=30.0, backoff=1.5, timeout=VIDEO_PROCESSING_TIMEOUT):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self._pending = {}
+        self._wakeup = None
+        self._task = None
+        self._loop = None
+
+    def watch(self, object_id, access_token, field, classify, version='v20.0', timeout=None, platform='facebook', account=None):
+        """
+        Start tracking object_id and return a future for its final status.
+        account is the rate-limit key the publishing calls use for the same
+        page or Instagram account, so checks and publishes share one bucket.
+
+        classify receives the object's JSON and returns "ready", "error" or None
+        while processing continues. The future resolves to the JSON on "ready" and
+        raises VideoProcessingError or TimeoutError otherwise.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # A new event loop (e.g. a fresh asyncio.run) cannot reuse the old task
+            self._loop = loop
+            self._pending = {}
+            self._wakeup = asyncio.Event()
+            self._task = None
+
+        future = loop.create_future()
+        self._pending[object_id] = _Pending(
+            object_id, access_token, platform, account, version, field, classify, future,
+            self.timeout if timeout is None else timeout, self.initial_delay
+        )
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        self._wakeup.set()
+        return future
+
+    async def _run(self):
+        while self._pending:
+            now = time.monotonic()
+            due = {}
+            for object_id, item in list(self._pending.items()):
+                if item.future.done():
+                    # The caller gave up (e.g. a fan-out deadline cancelled it)
+                    del self._pending[object_id]
+                elif now >= item.deadline:
+                    del self._pending[object_id]
+                    item.future.set_exception(TimeoutError(f"{object_id} still processing after timeout"))
+                elif now >= item.next_check:
+                    due.setdefault(item.group, []).append(item)
+
+            for group, items in due.items():
+                for start in range(0, len(items), GRAPH_BATCH_SIZE):
+                    batch = items[start:start + GRAPH_BATCH_SIZE]
+                    try:
+                        await self._check(group, batch)
+                    except Exception as e:
+                        # One bad check must not stop the task every other waiter depends on
+                        print("Error checking processing status:", e)
+                        for item in batch:
+                            item.delay = min(item.delay * self.backoff, self.max_delay)
+                            item.next_check = time.monotonic() + item.delay
+
+            if not self._pending:
+                break
+            next_check = min(min(item.next_check, item.deadline) for item in self._pending.values())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, next_check - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self, group, items):
+        platform, account, version, field, access_token = group
+        try:
+            response = await http_client.request(
+                "GET", f"{GRAPH_API_BASE}/{version}/",
+                params={
+                    "ids": ",".join(item.object_id for item in items),
+                    "fields": field,
+                    "access_token": access_token,
+                },
+                platform=platform, account=account
+            )
+            response.raise_for_status()
+            statuses = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            # Treat a failed check as "still processing"; the deadline still applies
+            print("Error checking processing status:", e)
+            statuses = {}
+
+        for item in items:
+            if item.future.done():
+                # Cancelled (e.g. by a fan-out deadline) while the request was in flight
+                if self._pending.get(item.object_id) is item:
+                    del self._pending[item.object_id]
+                continue
+            status = statuses.get(item.object_id)
+            state = item.classify(status) if status is not None else None
+            if state == "ready":
+                self._pending.pop(item.object_id, None)
+                item.future.set_result(status)
+            elif state == "error":
+                self._pending.pop(item.object_id, None)
+                item.future.set_exception(VideoProcessingError(item.object_id, status))
+            else:
+                item.delay = min(item.delay * self.backoff, self.max_delay)
+                item.next_check = time.monotonic() + item.delay
+
+
+def _facebook_video_state(status_json):
+    video_status = status_json.get('status', {}).get('video_status')
+    if video_status == 'ready':
+        return "ready"
+    if video_status == 'error':
+        return "error"
+    return None
+
+
+def _instagram_container_state(status_json):
+    status_code = status_json.get('status_code')
+    if status_code == 'FINISHED':
+        return "ready"
+    if status_code in ('ERROR', 'EXPIRED'):
+        return "error"
+    return None
+
+
+poller = StatusPoller()
+
+
+def wait_for_facebook_video(video_id, page_access_token, page_id, timeout=None):
+    return poller.watch(video_id, page_access_token, 'status', _facebook_video_state, 'v20.0', timeout, 'facebook', page_id)
+
+
+def wait_for_instagram_container(container_id, access_token, ig_id, timeout=None):
+    return poller.watch(container_id, access_token, 'status_code', _instagram_container_state, 'v18.0', timeout, 'instagram', ig_id)
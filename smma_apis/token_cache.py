@@ -0,0 +1,67 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class TokenCache:
+    """
+    Small in-process TTL cache for values that are expensive to look up but
+    rarely change, such as page access tokens and user ids.
+
+    Concurrent lookups for the same key share a single fetch. Entries are
+    dropped when they expire or when a caller reports them as rejected
+    (for example after a 401).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._locks = {}
+
+    async def get(self, key, fetch):
+        """
+        Return the cached value for key, calling the coroutine function fetch() on a miss.
+        None results are not cached so that a failed lookup is retried next time.
+        """
+        value = self._lookup(key)
+        if value is not None:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            value = self._lookup(key)
+            if value is None:
+                value = await fetch()
+                if value is not None:
+                    self._entries[key] = (value, time.monotonic() + self.ttl)
+        return value
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def discard_value(self, value):
+        """
+        Forget every entry holding value, e.g. a token the API just rejected.
+        """
+        for key, (cached, _) in list(self._entries.items()):
+            if cached == value:
+                del self._entries[key]
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        return value
+
+
+# Page access tokens derived from a long-lived user token do not expire on their own
+facebook_page_tokens = TokenCache(ttl=float(os.environ.get("FACEBOOK_PAGE_TOKEN_TTL", "3600")))
+# A LinkedIn member id never changes for a given access token
+linkedin_user_ids = TokenCache(ttl=float(os.environ.get("LINKEDIN_USER_ID_TTL", "86400")))
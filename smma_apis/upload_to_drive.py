@@ -1,30 +1,111 @@
 #pip install google-api-python-client
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
 from google.oauth2 import service_account
+import mimetypes
 import os
+import threading
+import time
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
 SERVICE_ACCOUNT_FILE = 'social_media_script/upload_to_drive_creds.json'
 PARENT_FOLDER_ID = "1vKJCWzipjtbkHY4Zjc-4EobN5wBBtwgY"
 
+# Drive requires resumable chunks to be a multiple of 256 KiB
+CHUNK_ALIGNMENT = 256 * 1024
+UPLOAD_CHUNK_SIZE = int(os.environ.get("DRIVE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# How many times a single chunk is retried after a transient failure
+UPLOAD_RETRIES = int(os.environ.get("DRIVE_UPLOAD_RETRIES", "5"))
+
+_creds = None
+_creds_lock = threading.Lock()
+# httplib2 connections are not thread-safe, so each thread builds its service once
+_local = threading.local()
+
 def authenticate():
     creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
     return creds
 
-def upload_photo(file_path):
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+def get_credentials():
+    """
+    Load the service-account credentials once per process.
+    The authorized HTTP client refreshes the access token whenever it expires.
+    """
+    global _creds
+    with _creds_lock:
+        if _creds is None:
+            _creds = authenticate()
+        return _creds
+
+def get_service():
+    """
+    Return this thread's Drive client, building it on first use.
+    """
+    service = getattr(_local, 'service', None)
+    if service is None:
+        service = build('drive', 'v3', credentials=get_credentials(), cache_discovery=False)
+        _local.service = service
+    return service
+
+def _media_body(source, mimetype, chunk_size):
+    chunk_size = max(CHUNK_ALIGNMENT, chunk_size - chunk_size % CHUNK_ALIGNMENT)
+    if isinstance(source, (str, os.PathLike)):
+        return MediaFileUpload(source, mimetype=mimetype, chunksize=chunk_size, resumable=True)
+    # Any readable, seekable file object, e.g. UploadFile.file
+    return MediaIoBaseUpload(source, mimetype=mimetype, chunksize=chunk_size, resumable=True)
+
+def _is_transient(error):
+    if isinstance(error, HttpError):
+        return error.resp.status in (408, 429) or error.resp.status >= 500
+    return isinstance(error, (ConnectionError, TimeoutError))
 
-    file_name = os.path.basename(file_path)
+def _execute_resumable(request):
+    """
+    Send a resumable upload chunk by chunk. After a transient failure the same
+    session is continued from the last byte Drive acknowledged, so a dropped
+    connection does not restart a large upload from zero.
+    """
+    response = None
+    failures = 0
+    while response is None:
+        try:
+            _, response = request.next_chunk(num_retries=UPLOAD_RETRIES)
+            failures = 0
+        except Exception as e:
+            failures += 1
+            if not _is_transient(e) or failures > UPLOAD_RETRIES:
+                raise
+            print(f"Upload interrupted ({e}), resuming...")
+            time.sleep(min(2 ** failures, 30))
+    return response
+
+def upload_and_get_link(source, file_name=None, mimetype=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Upload a file, make it readable by anyone with the link and return
+    (file_id, webContentLink). The link comes back with the create call, so no
+    separate lookup is needed.
+
+    source is a path or a file object. File objects are streamed as they are,
+    so an uploaded request body never has to be written to disk first. The
+    upload is resumable and sent in chunk_size pieces.
+    """
+    service = get_service()
+
+    if file_name is None:
+        file_name = os.path.basename(source) if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', 'upload')
+    mimetype = mimetype or mimetypes.guess_type(str(file_name))[0] or 'application/octet-stream'
     file_metadata = {
         'name': file_name,
         'parents': [PARENT_FOLDER_ID]
     }
 
-    file = service.files().create(
+    request = service.files().create(
         body=file_metadata,
-        media_body=file_path
-    ).execute()
+        media_body=_media_body(source, mimetype, chunk_size),
+        fields='id, webContentLink'
+    )
+    file = _execute_resumable(request)
 
     # Set the file permission to 'anyone with the link'
     permission = {
@@ -36,17 +117,19 @@ def upload_photo(file_path):
         body=permission
     ).execute()
 
-    return file.get('id')
+    return file.get('id'), file.get('webContentLink')
+
+def upload_photo(file_path):
+    file_id, _ = upload_and_get_link(file_path)
+    return file_id
 
 def get_download_link(file_id):
-    creds = authenticate()
-    service = build('drive', 'v3', credentials=creds)
+    service = get_service()
 
     file = service.files().get(fileId=file_id, fields='webContentLink').execute()
     return file.get('webContentLink')
 
 # Example usage
 # if __name__ == "__main__":
-#     uploaded_file_id = upload_photo("media_for_twitter\Recording 2025-01-18 230252.mp4")
-#     download_link = get_download_link(uploaded_file_id)
+#     uploaded_file_id, download_link = upload_and_get_link("media_for_twitter\Recording 2025-01-18 230252.mp4")
 #     print(f"Direct download link: {download_link}")
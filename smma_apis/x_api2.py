@@ -1,6 +1,7 @@
 import tweepy
 import os 
 from dotenv import load_dotenv 
+from smma_apis.rate_limit import account_id, call_with_limits
 
 load_dotenv() 
 
@@ -18,17 +19,36 @@ auth = tweepy.OAuth1UserHandler(api_key, api_secret, access_token, access_token_
 
 api = tweepy.API(auth)
 
+account = account_id(access_token)
+
+def _rate_limit_headers(error):
+    if isinstance(error, tweepy.TooManyRequests):
+        return error.response.headers
+    return None
+
+def upload_media(image_url):
+    """
+    Upload an image and return its media id. X keeps uploaded media for 24 hours,
+    so the id can be attached to several tweets.
+    """
+    media = call_with_limits("twitter", account, lambda: api.media_upload(filename=image_url), _rate_limit_headers)
+    return media.media_id
+
+def post_tweet(text, media_ids=None):
+    response = call_with_limits(
+        "twitter", account, lambda: client.create_tweet(text=text, media_ids=media_ids), _rate_limit_headers
+    )
+    print(f"Tweet posted successfully. Tweet ID: {response.data['id']}")
+    return response
+
 def post_tweet_with_image(text, image_url=None):
     if image_url:
-        # Upload the image
-        media = api.media_upload(filename=image_url)
-        # Create a tweet with text and image
-        response = client.create_tweet(text=text, media_ids=[media.media_id])
+        # Upload the image, then create a tweet with text and image
+        response = post_tweet(text, [upload_media(image_url)])
     else:
         # Create a tweet with only text
-        response = client.create_tweet(text=text)
-    
-    print(f"Tweet posted successfully. Tweet ID: {response.data['id']}")
+        response = post_tweet(text)
+    return response
 
 
 
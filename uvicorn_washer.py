@@ -1,15 +1,16 @@
+import asyncio
 import json
 import os
 import sys
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from dotenv import load_dotenv
-import openai
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Literal, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.chat_models import ChatAnthropic
 # Add the parent directory to sys.path to import the API modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
@@ -18,8 +19,17 @@ from smma_apis import x_api2
 from smma_apis import insta_api 
 from smma_apis import facebook_api 
 from smma_apis import upload_to_drive
-from client.groq_llama_vision import take_screenshots, process_images
-from langchain_openai import ChatOpenAI
+from smma_apis import http_client
+from smma_apis.fanout import fan_out, platform_timeout
+from client.groq_llama_vision import iter_frame_jpegs, iter_image_descriptions, prepare_image
+from media_cache import cache as media_cache, caption_key
+from llm_clients import get_chat_model, get_groq_client
+from jobs import job_queue
+from scheduler import post_scheduler
+from ingest import IngestedFile, ingest_form
+from cpu_pool import cpu_pool
+from caption_prompt import CAPTION_PROMPT_VERSION, build_caption_messages
+from smma_apis.media_handles import media_handles
 
 load_dotenv()
 
@@ -40,131 +50,350 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.on_event("shutdown")
+async def close_http_clients():
+    await http_client.close_clients()
+
+@app.on_event("shutdown")
+async def stop_cpu_pool():
+    cpu_pool.shutdown()
+
 class PostRequest(BaseModel):
     content: str
     media_type: str
 
-import tempfile
-import shutil
-
-# Existing endpoints...
+import concurrent.futures
+import threading
+import uuid
 
-@app.post("/analyze_media_and_gen_caption")
-async def analyze_media(file: UploadFile = File(...), is_video: bool = Form(False), interval: int = Form(30), llm_type: str = Form("gpt-4o"), api_key: str = None, groq_api_key: str = None):
-    client = openai.OpenAI(
-        base_url="https://api.groq.com/openai/v1",
-        api_key= groq_api_key
-    )   
+# Items iterate_in_thread lets a worker thread run ahead of its consumer
+ITERATE_MAX_BUFFERED = 8
 
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
-        temp_file_path = temp_file.name
+# Existing endpoints...
 
+# Which key each caption LLM needs, checked before any vision call is made
+CAPTION_LLMS = {
+    "gpt-4o": "Openai",
+    "llama-3.3-70b-versatile": "Groq",
+    "gemma2-9b-it": "Groq",
+    "claude-3-sonnet": "Anthropic",
+}
+
+def check_caption_llm(llm_type, api_key):
+    if llm_type not in CAPTION_LLMS:
+        raise HTTPException(status_code=400, detail="Invalid LLM type")
+    if not api_key:
+        raise HTTPException(status_code=400, detail=f"{CAPTION_LLMS[llm_type]} API key is required")
+
+def parse_generation(response):
+    if response.startswith("```json"):
+        striped_query = response[len("```json") :].strip()
+        if striped_query.endswith("```"):
+            striped_query = striped_query[: -len("```")].strip()
+
+        return json.loads(striped_query)
+
+    return json.loads(response)
+
+class AnalyzeOptions(BaseModel):
+    is_video: bool = False
+    # Seconds between sampled frames; 0 or less would never advance through the video
+    interval: int = Field(30, gt=0)
+    max_frames: int = Field(0, ge=0)
+    llm_type: str = "gpt-4o"
+
+def multipart_openapi(fields):
+    """
+    openapi_extra documenting a multipart/form-data body with a required "file"
+    field and the given optional fields, for routes that stream the raw request.
+    """
+    properties = {"file": {"type": "string", "format": "binary"}, **fields}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {"type": "object", "properties": properties, "required": ["file"]},
+                },
+            },
+        },
+    }
+
+# Kept in step with AnalyzeOptions
+ANALYZE_FORM_OPENAPI = multipart_openapi({
+    "is_video": {"type": "boolean", "default": False},
+    "interval": {"type": "integer", "default": 30, "exclusiveMinimum": 0},
+    "max_frames": {"type": "integer", "default": 0, "minimum": 0},
+    "llm_type": {"type": "string", "default": "gpt-4o", "enum": list(CAPTION_LLMS)},
+})
+
+async def read_analyze_form(request, directory=None):
+    """
+    Stream the analysis form in one pass and return (AnalyzeOptions, IngestedFile).
+    The upload's sha256 lets repeat uploads of the same creative hit the cache.
+    """
+    fields, upload = await ingest_form(request, directory=directory)
+    if upload is None:
+        raise HTTPException(status_code=422, detail="A file is required")
     try:
-        if is_video:
-            screenshot_paths = take_screenshots(temp_file_path, interval)
-            raw_results = process_images(screenshot_paths, client)
-            results = {f"screenshot{i+1}": result for i, result in enumerate(raw_results)}
-        else:
-            raw_results = process_images([temp_file_path], client)
-            results = {"image": raw_results[0]}
-
-        print("Results: ", results)
-
-        system_prompt = """
-        You are tasked to generate a caption based on an image description that you will be provided. 
-        This is the image description: {image_description} 
-
-        There may be multiple image descriptions provided at once, in that case analyse them all and come up with an eye catching caption for social media. 
-
-        ALWAYS PROVIDE A JSON RESPONSE AS YOUR ANSWER!!
-
-        Example: 
-        image description: {{'screenshot1': 'The image depicts a narrow canyon with tall, orange rock formations on either side. The sky is bright blue and clear, with two birds flying in the distance. The overall atmosphere suggests a sunny day in a natural setting, possibly during the daytime when the sun is high in the sky.\n\n**Key Features:**\n\n* **Canyon Walls:** The canyon walls are made of orange rock formations that rise high into the sky.\n* **Sky:** The sky is bright blue and clear, with no clouds or obstructions visible.\n* **Birds:** Two birds can be seen flying in the distance, adding a sense of movement and life to the scene.\n* **Lighting:** The lighting is natural, with the sun shining down from above and casting shadows on the canyon walls.\n* **Atmosphere:** The atmosphere is peaceful and serene, with a sense of vastness and openness due to the expansive sky and towering canyon walls.\n\n**Mood and Emotion:**\n\n* The image evokes a feeling of awe and wonder at the natural beauty of the canyon and the vastness of the sky.\n* The peaceful atmosphere creates a sense of calmness and serenity, inviting the viewer to step into the scene and experience it for themselves.\n* The presence of the birds adds a sense of movement and life to the scene, suggesting that this is a place where nature thrives and flourishes.', 'screenshot2': 'This image depicts a photograph of two tall, reddish-orange rock formations with a bright blue sky between them. The rock formations are likely made of sandstone, a common geological feature in desert environments.\n\n**Key Features:**\n\n* **Rock Formations:** The rock formations dominate the image, characterized by their reddish-orange hue and rough texture.\n* **Blue Sky:** The bright blue sky is visible through the gap between the two rock formations, adding contrast to the scene.\n* **Desert Landscape:** The overall setting appears to be a desert or arid region, given the type of rock formations and the clear blue sky.\n\n**Composition:**\n\n* **Symmetry:** The photo is composed symmetrically, with the two rock formations roughly equal in size and shape on either side of the frame.\n* **Depth:** The image creates a sense of depth, with the rock formations receding into the distance and the blue sky fading towards the horizon.\n\n**Mood and Atmosphere:**\n\n* **Serenity:** The combination of the blue sky and the natural beauty of the rock formations evokes a sense of serenity and tranquility.\n* **Awe-Inspiring:** The sheer scale and grandeur of the rock formations likely inspire a sense of awe in the viewer.'}}
-        Answer: {{
-  "captions": [
-    {{
-      "title": "Nature's Timeless Canvas 🌄✨",
-      "text": "Towering orange canyon walls rise high into a brilliant blue sky, framing a peaceful desert landscape. Two birds soar in the distance, adding a sense of movement to the serene, sunlit scene. The play of natural light and shadows enhances the breathtaking beauty of this arid wonder, where time and nature sculpt their masterpieces."
-    }},
-    {{
-      "title": "Between Giants: A View to Remember 🏜️🔆",
-      "text": "Two colossal reddish-orange sandstone formations stand tall, parting just enough to reveal an endless blue sky. Their rugged textures tell the story of time, wind, and erosion, shaping this awe-inspiring desert landscape. A moment of stillness, a sense of vastness—this is nature's quiet grandeur at its best."
-    }},
-    {{
-      "title": "Silence, Sky, and Sandstone Wonders ⛰️🌤️",
-      "text": "A peaceful canyon bathed in sunlight, its orange rock walls stretching toward a vibrant blue sky. The atmosphere is calm, the scene untouched—except for two birds gliding effortlessly overhead. With perfect symmetry and depth, the canyon draws you in, reminding us of nature's raw and timeless beauty."
-    }},
-    {{
-      "title": "Where Earth Meets Sky: The Canyon's Grand Embrace 🌍💫",
-      "text": "Massive rock formations stand side by side, creating a natural gateway to the heavens. The warm hues of sandstone contrast sharply against the clear, endless sky, making the scene feel both tranquil and powerful. A breathtaking blend of nature's artistry and the vastness of the wild."
-    }}
-  ]
-}}
-        """.format(
-            image_description = str(results)
-        )
-
-        if llm_type == "gpt-4o":
-            if not api_key:
-                raise HTTPException(status_code=400, detail="Openai API key is required")
-            model = ChatOpenAI(model="gpt-4o", api_key=api_key)
-            # prompt = ChatPromptTemplate.from_template([
-            #     ("system", system_prompt),
-                
-            # ])
-            # chain = system_prompt | model | StrOutputParser()
-            response = model.invoke(system_prompt)
-            response = response.content
-
-        elif llm_type in ["llama-3.3-70b-versatile", "gemma2-9b-it"]:
-            if not api_key:
-               raise HTTPException(status_code=400, detail="Groq API key is required")
-            response = client.chat.completions.create(
+        return AnalyzeOptions(**fields), upload
+    except ValidationError as e:
+        upload.close()
+        raise HTTPException(status_code=422, detail=str(e))
+
+def describe_media(upload, is_video, interval, max_frames, client):
+    """
+    Yield (result key, description) pairs as each frame description finishes.
+    """
+    if is_video:
+        # OpenCV needs a file, but the frames go from the decoder to the vision requests in memory
+        # max_frames > 0 picks up to that many distinct scenes instead of every interval
+        frames = iter_frame_jpegs(upload.as_path(), interval, max_frames=max_frames)
+        for index, description in iter_image_descriptions(frames, client, cache=media_cache):
+            yield f"screenshot{index+1}", description
+    else:
+        # Uploads are shrunk to what the vision model uses before they are sent
+        image = cpu_pool.submit(prepare_image, upload.source()).result()
+        for _, description in iter_image_descriptions([image], client, cache=media_cache):
+            yield "image", description
+
+async def iterate_in_thread(iterator, max_buffered=ITERATE_MAX_BUFFERED):
+    """
+    Consume a blocking iterator on a worker thread and yield its items here,
+    so the event loop stays free while the iterator waits on I/O.
+
+    At most max_buffered items wait in the queue; the worker blocks beyond
+    that. When the consumer stops early (e.g. an SSE client disconnects) the
+    worker stops pulling items and closes the iterator, so no more frames are
+    decoded or described.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(max_buffered)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        try:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        except RuntimeError:
+            # The event loop is already closed
+            return False
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return False
+            except concurrent.futures.CancelledError:
+                return False
+
+    def pump():
+        try:
+            for item in iterator:
+                if stop.is_set() or not put(item):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        put(done)
+
+    worker = loop.run_in_executor(None, pump)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+    await worker
+
+async def stream_caption(llm_type, api_key, client, messages):
+    """
+    Yield the caption text from the chosen LLM as it is generated.
+    """
+    if llm_type == "gpt-4o":
+        model = get_chat_model(llm_type, api_key)
+        async for chunk in model.astream(messages):
+            yield chunk.content
+    elif llm_type in ["llama-3.3-70b-versatile", "gemma2-9b-it"]:
+        def groq_chunks():
+            # Opening the stream sends the request, so it happens on the worker thread too
+            stream = client.chat.completions.create(
                 model=llm_type,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    
-                ],
+                messages=messages,
                 temperature=0.7,
-                max_tokens=1000
+                max_tokens=1000,
+                stream=True
             )
-            response = response.choices[0].message.content
-        elif llm_type == "claude-3-sonnet":
-            if not api_key:
-                raise HTTPException(status_code=400, detail="Anthropic API key is required")
-            llm = ChatAnthropic(
-                model="claude-3-sonnet-20240229",
-                api_key=api_key
-            )
-            response = llm.invoke(system_prompt)
-            response = response.content
+            yield from stream
+
+        async for chunk in iterate_in_thread(groq_chunks()):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    elif llm_type == "claude-3-sonnet":
+        llm = get_chat_model(llm_type, api_key)
+        async for chunk in llm.astream(messages):
+            yield chunk.content
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def generate_caption(llm_type, api_key, client, messages):
+    if llm_type == "gpt-4o":
+        model = get_chat_model(llm_type, api_key)
+        # prompt = ChatPromptTemplate.from_template([
+        #     ("system", system_prompt),
+            
+        # ])
+        # chain = system_prompt | model | StrOutputParser()
+        response = model.invoke(messages)
+        return response.content
+
+    elif llm_type in ["llama-3.3-70b-versatile", "gemma2-9b-it"]:
+        response = client.chat.completions.create(
+            model=llm_type,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=1000
+        )
+        return response.choices[0].message.content
+    elif llm_type == "claude-3-sonnet":
+        llm = get_chat_model(llm_type, api_key)
+        response = llm.invoke(messages)
+        return response.content
+
+async def caption_media(upload, is_video, interval, max_frames, llm_type, api_key, groq_api_key, on_progress=None):
+    """
+    Describe the uploaded media and generate captions for it, returning the
+    {"results", "generation"} body. Blocking work runs on worker threads.
+    on_progress, if given, is called with a progress dict after each step.
+    """
+    client = get_groq_client(groq_api_key)
+    cache_key = caption_key(
+        upload.sha256, llm_type, CAPTION_PROMPT_VERSION,
+        is_video=is_video, interval=interval, max_frames=max_frames
+    )
+    cached = media_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    descriptions = {}
+    async for key, description in iterate_in_thread(describe_media(upload, is_video, interval, max_frames, client)):
+        descriptions[key] = description
+        if on_progress:
+            on_progress({"stage": "describing", "frames_described": len(descriptions)})
+    if is_video:
+        results = {f"screenshot{i+1}": descriptions[f"screenshot{i+1}"] for i in range(len(descriptions))}
+    else:
+        results = descriptions
 
-        else:
-            raise HTTPException(status_code=400, detail="Invalid LLM type")
+    print("Results: ", results)
 
-        if response.startswith("```json"):
-            striped_query = response[len("```json") :].strip()
-            if striped_query.endswith("```"):
-                striped_query = striped_query[: -len("```")].strip()
+    if on_progress:
+        on_progress({"stage": "captioning", "frames_described": len(descriptions)})
+    messages = build_caption_messages(results)
+    response = await asyncio.to_thread(generate_caption, llm_type, api_key, client, messages)
+    json_query = parse_generation(response)
 
-            json_query = json.loads(striped_query)
+    media_cache.set(cache_key, {"results": results, "generation": json_query})
+    return {"results": results, "generation": json_query}
 
-        else:
-            json_query = json.loads(response)
+@app.post("/analyze_media_and_gen_caption", openapi_extra=ANALYZE_FORM_OPENAPI)
+async def analyze_media(request: Request, api_key: str = None, groq_api_key: str = None):
+    """
+    Multipart form: file, is_video (false), interval (30), max_frames (0), llm_type ("gpt-4o").
+    """
+    options, upload = await read_analyze_form(request)
+    try:
+        check_caption_llm(options.llm_type, api_key)
+        return await caption_media(
+            upload, options.is_video, options.interval, options.max_frames, options.llm_type, api_key, groq_api_key
+        )
+    finally:
+        upload.close()
+
+@app.post("/analyze_media_and_gen_caption/stream", openapi_extra=ANALYZE_FORM_OPENAPI)
+async def analyze_media_stream(request: Request, api_key: str = None, groq_api_key: str = None):
+    """
+    Server-sent events version of /analyze_media_and_gen_caption.
+    Emits a "frame" event per description as it finishes, "token" events while
+    the caption is generated, then one "generation" event with the same body
+    the non-streaming endpoint returns. Failures are reported as an "error" event.
+    """
+    options, upload = await read_analyze_form(request)
+    try:
+        check_caption_llm(options.llm_type, api_key)
+    except HTTPException:
+        upload.close()
+        raise
+    is_video, interval, max_frames, llm_type = options.is_video, options.interval, options.max_frames, options.llm_type
+    client = get_groq_client(groq_api_key)
+    cache_key = caption_key(
+        upload.sha256, llm_type, CAPTION_PROMPT_VERSION,
+        is_video=is_video, interval=interval, max_frames=max_frames
+    )
 
-        
-        return {"results": results, "generation": json_query}
+    async def events():
+        try:
+            cached = media_cache.get(cache_key)
+            if cached is not None:
+                for key, description in cached["results"].items():
+                    yield sse_event("frame", {"key": key, "description": description})
+                yield sse_event("generation", cached)
+                return
+
+            descriptions = {}
+            async for key, description in iterate_in_thread(
+                describe_media(upload, is_video, interval, max_frames, client)
+            ):
+                descriptions[key] = description
+                yield sse_event("frame", {"key": key, "description": description})
+            if is_video:
+                results = {f"screenshot{i+1}": descriptions[f"screenshot{i+1}"] for i in range(len(descriptions))}
+            else:
+                results = descriptions
+
+            response = ""
+            async for text in stream_caption(llm_type, api_key, client, build_caption_messages(results)):
+                response += text
+                yield sse_event("token", {"text": text})
+
+            body = {"results": results, "generation": parse_generation(response)}
+            media_cache.set(cache_key, body)
+            yield sse_event("generation", body)
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            upload.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/upload", openapi_extra=multipart_openapi({}))
+async def upload_file(request: Request):
+    """
+    Multipart form with a single file field. Small files are sent to Drive straight
+    from memory; the Drive upload needs a seekable source to resume after errors,
+    so larger ones are written to disk once rather than piped through.
+    """
+    _, upload = await ingest_form(request)
+    if upload is None:
+        raise HTTPException(status_code=422, detail="A file is required")
+    try:
+        with upload.open() as source:
+            _, media_url = await asyncio.to_thread(
+                upload_to_drive.upload_and_get_link, source, upload.filename, upload.content_type
+            )
     finally:
-        os.unlink(temp_file_path)
-        if is_video:
-            for screenshot_path in screenshot_paths:
-                os.unlink(screenshot_path)
-
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    file_id = upload_to_drive.upload_photo(file.file)
-    media_url = upload_to_drive.get_download_link(file_id)
+        upload.close()
     return {"media_url": media_url}
 
 @app.post("/post/linkedin")
@@ -172,7 +401,10 @@ async def post_to_linkedin(request: PostRequest, media_url: str = Form(None)):
     access_token = os.environ.get("LINKEDIN_ACCESS_TOKEN")
     title = request.content[:50]  # Using first 50 characters as title
     try:
-        LinkedinAutomate(access_token, media_url, title, request.content, request.media_type).main_func()
+        linkedin = LinkedinAutomate(access_token, media_url, title, request.content, request.media_type)
+        # main_func returns None instead of raising when LinkedIn rejects a step
+        if not await linkedin.main_func():
+            return {"error": "Failed to post to LinkedIn: the post could not be created"}
         return {"message": "Posted successfully to LinkedIn"}
     except Exception as e:
         return {"error": f"Failed to post to LinkedIn: {str(e)}"}
@@ -180,7 +412,7 @@ async def post_to_linkedin(request: PostRequest, media_url: str = Form(None)):
 @app.post("/post/twitter")
 async def post_to_twitter(request: PostRequest, media_url: str = Form(None)):
     try:
-        x_api2.post_tweet_with_image(request.content, media_url)
+        await asyncio.to_thread(x_api2.post_tweet_with_image, request.content, media_url)
         return {"message": "Posted successfully to Twitter"}
     except Exception as e:
         return {"error": f"Failed to post to Twitter: {str(e)}"}
@@ -188,7 +420,8 @@ async def post_to_twitter(request: PostRequest, media_url: str = Form(None)):
 @app.post("/post/instagram")
 async def post_to_instagram(request: PostRequest, media_url: str = Form(None)):
     try:
-        insta_api.post_to_instagram(request.content, media_url, request.media_type)
+        if not await insta_api.post_to_instagram(request.content, media_url, request.media_type):
+            return {"error": "Failed to post to Instagram: the post could not be created"}
         return {"message": "Posted successfully to Instagram"}
     except Exception as e:
         return {"error": f"Failed to post to Instagram: {str(e)}"}
@@ -201,11 +434,12 @@ async def post_to_facebook(request: PostRequest, media_url: str = Form(None)):
     if not user_access_token or not page_id:
         return {"error": "Facebook user access token or page ID not found in environment variables."}
 
-    page_access_token = facebook_api.get_page_access_token(page_id, user_access_token)
+    page_access_token = await facebook_api.get_cached_page_access_token(page_id, user_access_token)
     
     if page_access_token:
         try:
-            facebook_api.post_fb(page_id, page_access_token, request.content, media_url, request.media_type)
+            if not await facebook_api.post_fb(page_id, page_access_token, request.content, media_url, request.media_type):
+                return {"error": "Failed to post to Facebook: the post could not be created"}
             return {"message": "Posted successfully to Facebook"}
         except Exception as e:
             return {"error": f"Failed to post to Facebook: {str(e)}"}
@@ -214,41 +448,377 @@ async def post_to_facebook(request: PostRequest, media_url: str = Form(None)):
 
 @app.post("/post/all")
 async def post_to_all(request: PostRequest, media_url: str = Form(None)):
-    results = {}
-    
-    # Upload to Google Drive and get the download link
-    file_id = upload_to_drive.upload_photo(media_url)
-    media_url_for_graph = upload_to_drive.get_download_link(file_id)
-
-    # Post to Facebook
+    # Upload to Google Drive and get the download link; text-only posts have nothing to upload
+    media_url_for_graph = None
+    if media_url:
+        _, media_url_for_graph = await asyncio.to_thread(upload_to_drive.upload_and_get_link, media_url)
+
+    # Publish to every platform at once; each one gets its own deadline
+    return await fan_out({
+        "facebook": lambda: post_to_facebook(request, media_url_for_graph),
+        "instagram": lambda: post_to_instagram(request, media_url_for_graph),
+        "twitter": lambda: post_to_twitter(request, media_url),
+        "linkedin": lambda: post_to_linkedin(request, media_url),
+    }, default_timeout=platform_timeout(request.media_type))
+
+# Publishes from one /post/batch call that may run at the same time
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "4"))
+# Batch items due within this many seconds wait in the request; later ones go to the scheduler,
+# so the request is never held open long enough to hit a proxy timeout
+BATCH_MAX_WAIT = float(os.environ.get("BATCH_MAX_WAIT", "5"))
+
+Platform = Literal["facebook", "instagram", "twitter", "linkedin"]
+
+class BatchItem(BaseModel):
+    content: str
+    media_type: str = "image"
+    media_url: Optional[str] = None
+    platforms: List[Platform] = ["facebook", "instagram", "twitter", "linkedin"]
+    publish_at: Optional[datetime] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+
+def seconds_until(publish_at):
+    if publish_at is None:
+        return 0.0
+    # Naive timestamps are taken as UTC
+    if publish_at.tzinfo is None:
+        publish_at = publish_at.replace(tzinfo=timezone.utc)
+    return (publish_at - datetime.now(timezone.utc)).total_seconds()
+
+class BatchMedia:
+    """
+    Stages each distinct media file once per batch with stage_media (Drive
+    link, X media id, LinkedIn asset), for every platform any item using it
+    posts to. Items that share a file await the same staging. Instagram
+    containers embed their caption, so they are still created per item.
+    """
+
+    def __init__(self, items):
+        self._platforms = {}
+        for item in items:
+            if item.media_url:
+                self._platforms.setdefault((item.media_url, item.media_type), set()).update(item.platforms)
+        self._staged = {}
+
+    def staged(self, media_url, media_type):
+        key = (media_url, media_type)
+        if key not in self._staged:
+            self._staged[key] = asyncio.ensure_future(stage_media(media_url, media_type, self._platforms[key]))
+        return self._staged[key]
+
+async def publish_batch_item(item, batch_media, slots):
+    request = PostRequest(content=item.content, media_type=item.media_type)
+    # Staging runs inside the slot too, so uploads are bounded by BATCH_MAX_CONCURRENCY
+    async with slots:
+        staged = await batch_media.staged(item.media_url, item.media_type) if item.media_url else {}
+        return await publish_staged(request, item.media_url, item.platforms, staged)
+
+async def run_batch_item(index, item, batch_media, slots):
+    delay = seconds_until(item.publish_at)
+    if delay > BATCH_MAX_WAIT:
+        schedule_id = schedule_post(item)
+        return {"index": index, "status": "scheduled", "schedule_id": schedule_id}
+    if delay > 0:
+        # Waiting items do not hold a publishing slot
+        await asyncio.sleep(delay)
     try:
-        await post_to_facebook(request, media_url_for_graph)
-        results["facebook"] = "Success"
+        platforms = await publish_batch_item(item, batch_media, slots)
     except Exception as e:
-        results["facebook"] = f"Error: {str(e)}"
+        return {"index": index, "status": "error", "detail": str(e)}
+    ok = all(result["status"] == "success" for result in platforms.values())
+    return {"index": index, "status": "published" if ok else "partial", "platforms": platforms}
+
+@app.post("/post/batch")
+async def post_batch(batch: BatchRequest):
+    """
+    Publish many posts in one call. Each media file is uploaded once per
+    platform however many items use it, tokens and connections are shared through the
+    existing caches and pools, and at most BATCH_MAX_CONCURRENCY items publish
+    at the same time. Returns per-item and per-platform results in item order;
+    items due more than BATCH_MAX_WAIT seconds ahead are handed to the
+    scheduler and reported with their schedule_id.
+    """
+    batch_media = BatchMedia(batch.items)
+    slots = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    results = await asyncio.gather(*(
+        run_batch_item(index, item, batch_media, slots) for index, item in enumerate(batch.items)
+    ))
+    return {"items": results}
+
+# Prepared media: the slow uploads and processing run once, ahead of publishing
+
+async def stage_media(media_url, media_type, platforms, captions=()):
+    """
+    Do the slow part of publishing ahead of time: upload to Drive, upload the
+    LinkedIn asset and the X media, and create and process one Instagram
+    container per caption (a container embeds its caption). Steps that fail
+    are left out, and publishing falls back to the normal flow for them.
+    """
+    staged = {}
+    platforms = set(platforms)
+    if not media_url:
+        return staged
+
+    async def stage(key, coroutine):
+        try:
+            staged[key] = await coroutine
+        except Exception as e:
+            print(f"Staging {key} failed:", e)
 
-    # Post to Instagram
-    try:
-        await post_to_instagram(request, media_url_for_graph)
-        results["instagram"] = "Success"
-    except Exception as e:
-        results["instagram"] = f"Error: {str(e)}"
+    if {"facebook", "instagram"} & platforms:
+        try:
+            _, staged["graph_media_url"] = await asyncio.to_thread(upload_to_drive.upload_and_get_link, media_url)
+        except Exception as e:
+            print("Staging graph_media_url failed:", e)
+
+    async def create_containers():
+        # Created together, so the shared status poller waits on all of them at once
+        unique_captions = list(dict.fromkeys(captions))
+        container_ids = await asyncio.gather(*(
+            insta_api.create_container(caption, staged["graph_media_url"], media_type) for caption in unique_captions
+        ))
+        return {caption: container for caption, container in zip(unique_captions, container_ids) if container}
+
+    steps = []
+    if "instagram" in platforms and captions and "graph_media_url" in staged:
+        steps.append(stage("instagram_containers", create_containers()))
+    if "twitter" in platforms:
+        steps.append(stage("twitter_media_id", asyncio.to_thread(x_api2.upload_media, media_url)))
+    if "linkedin" in platforms:
+        linkedin = LinkedinAutomate(os.environ.get("LINKEDIN_ACCESS_TOKEN"), media_url, "", "", media_type)
+        steps.append(stage("linkedin_asset", linkedin.prepare_media()))
+    await asyncio.gather(*steps)
+    return staged
+
+async def publish_instagram_container(container_id):
+    post_id = await insta_api.publish_container(container_id)
+    if post_id:
+        return {"message": "Posted successfully to Instagram"}
+    return {"error": "Failed to post to Instagram: the container could not be published"}
 
-    # Post to Twitter
+async def publish_tweet(request, media_id):
     try:
-        await post_to_twitter(request, media_url)
-        results["twitter"] = "Success"
+        await asyncio.to_thread(x_api2.post_tweet, request.content, [media_id])
+        return {"message": "Posted successfully to Twitter"}
     except Exception as e:
-        results["twitter"] = f"Error: {str(e)}"
+        return {"error": f"Failed to post to Twitter: {str(e)}"}
 
-    # Post to LinkedIn
+async def publish_linkedin_asset(request, asset):
+    linkedin = LinkedinAutomate(
+        os.environ.get("LINKEDIN_ACCESS_TOKEN"), None, request.content[:50], request.content, request.media_type
+    )
     try:
-        await post_to_linkedin(request, media_url)
-        results["linkedin"] = "Success"
+        if not await linkedin.publish(asset):
+            return {"error": "Failed to post to LinkedIn: the post could not be created"}
+        return {"message": "Posted successfully to LinkedIn"}
     except Exception as e:
-        results["linkedin"] = f"Error: {str(e)}"
+        return {"error": f"Failed to post to LinkedIn: {str(e)}"}
+
+async def publish_staged(request, media_url, platforms, staged):
+    """
+    Publish request.content with media staged by stage_media. Anything that was
+    not staged falls back to the normal publishing flow.
+    """
+    graph_media_url = staged.get("graph_media_url")
+    if media_url and not graph_media_url and {"facebook", "instagram"} & set(platforms):
+        _, graph_media_url = await asyncio.to_thread(upload_to_drive.upload_and_get_link, media_url)
+
+    # An Instagram container can only be published once
+    container = staged.get("instagram_containers", {}).pop(request.content, None) if "instagram" in platforms else None
+    media_id = staged.get("twitter_media_id")
+    asset = staged.get("linkedin_asset")
+    publishers = {
+        "facebook": lambda: post_to_facebook(request, graph_media_url),
+        "instagram": (lambda: publish_instagram_container(container)) if container else (lambda: post_to_instagram(request, graph_media_url)),
+        "twitter": (lambda: publish_tweet(request, media_id)) if media_id else (lambda: post_to_twitter(request, media_url)),
+        "linkedin": (lambda: publish_linkedin_asset(request, asset)) if asset else (lambda: post_to_linkedin(request, media_url)),
+    }
+    return await fan_out(
+        {platform: publishers[platform] for platform in platforms},
+        default_timeout=platform_timeout(request.media_type),
+    )
+
+class PrepareRequest(BaseModel):
+    media_url: str
+    media_type: str = "image"
+    platforms: List[Platform] = ["facebook", "instagram", "twitter", "linkedin"]
+    # Instagram containers are created per caption, so list the captions known up front
+    captions: List[str] = []
 
-    return results
+class PublishRequest(BaseModel):
+    content: str
+    platforms: Optional[List[Platform]] = None
+
+@app.post("/prepare")
+async def prepare_media(request: PrepareRequest):
+    staged = await stage_media(request.media_url, request.media_type, request.platforms, request.captions)
+    handle = media_handles.add(request.media_url, request.media_type, request.platforms, staged)
+    return {
+        "handle": handle,
+        "expires_at": media_handles.get(handle)["expires_at"],
+        "staged": sorted(staged),
+        "instagram_captions": sorted(staged.get("instagram_containers", {})),
+    }
+
+@app.post("/publish/{handle}")
+async def publish_prepared(handle: str, request: PublishRequest):
+    prepared = media_handles.get(handle)
+    if prepared is None:
+        raise HTTPException(status_code=404, detail="Media handle not found or expired")
+    post_request = PostRequest(content=request.content, media_type=prepared["media_type"])
+    platforms = request.platforms or prepared["platforms"]
+    staged = prepared["staged"]
+    # Claim this caption's container in the store, so another worker cannot publish it too
+    container = media_handles.take_instagram_container(handle, request.content) if "instagram" in platforms else None
+    staged["instagram_containers"] = {request.content: container} if container else {}
+    return await publish_staged(post_request, prepared["media_url"], platforms, staged)
+
+@app.delete("/prepare/{handle}")
+async def discard_prepared(handle: str):
+    if not media_handles.discard(handle):
+        raise HTTPException(status_code=404, detail="Media handle not found or expired")
+    return {"message": "Media handle discarded"}
+
+# Scheduled posts: media is staged ahead of publish_at so publishing is a single fast call
+
+def item_payload(item):
+    return {
+        "content": item.content,
+        "media_type": item.media_type,
+        "media_url": item.media_url,
+        "platforms": list(item.platforms),
+    }
+
+def schedule_post(item):
+    publish_at = datetime.now(timezone.utc).timestamp() + seconds_until(item.publish_at)
+    return post_scheduler.schedule(item_payload(item), publish_at)
+
+async def stage_scheduled_post(payload):
+    return await stage_media(payload["media_url"], payload["media_type"], payload["platforms"], [payload["content"]])
+
+async def publish_scheduled_post(payload, staged):
+    request = PostRequest(content=payload["content"], media_type=payload["media_type"])
+    return await publish_staged(request, payload["media_url"], payload["platforms"], staged)
+
+post_scheduler.configure(stage_scheduled_post, publish_scheduled_post)
+
+@app.on_event("startup")
+async def start_post_scheduler():
+    post_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_post_scheduler():
+    await post_scheduler.stop()
+
+@app.post("/schedule")
+async def create_scheduled_post(item: BatchItem):
+    if item.publish_at is None:
+        raise HTTPException(status_code=400, detail="publish_at is required")
+    return {"schedule_id": schedule_post(item)}
+
+@app.get("/schedule/{schedule_id}")
+async def get_scheduled_post(schedule_id: str):
+    post = post_scheduler.get(schedule_id)
+    if post is None:
+        raise HTTPException(status_code=404, detail="Scheduled post not found")
+    return post
+
+@app.delete("/schedule/{schedule_id}")
+async def cancel_scheduled_post(schedule_id: str):
+    if not post_scheduler.cancel(schedule_id):
+        raise HTTPException(status_code=409, detail="Post is already publishing, published or cancelled")
+    return {"message": "Scheduled post cancelled"}
+
+# Background jobs: submit endpoints return a job id right away and /jobs/{job_id} reports progress
+
+JOBS_MEDIA_DIR = os.environ.get("JOBS_MEDIA_DIR", "job_media")
+# API keys sent with a job are only kept in memory, never written to the jobs database,
+# so analysis jobs are pinned to the process that received them
+job_secrets = {}
+
+async def run_analyze_job(payload, report_progress):
+    secrets = job_secrets.get(payload["secrets_id"])
+    try:
+        if secrets is None:
+            # Never fall back to the server's own keys for a caller's job
+            raise ValueError("The API keys for this job are no longer available; submit it again")
+        api_key, groq_api_key = secrets["api_key"], secrets["groq_api_key"]
+        return await caption_media(
+            IngestedFile(path=payload["path"], sha256=payload["upload_hash"]), payload["is_video"], payload["interval"],
+            payload["max_frames"], payload["llm_type"], api_key, groq_api_key, on_progress=report_progress
+        )
+    finally:
+        discard_analyze_job(payload)
+
+def discard_analyze_job(payload):
+    job_secrets.pop(payload["secrets_id"], None)
+    if os.path.exists(payload["path"]):
+        os.unlink(payload["path"])
+
+async def run_publish_job(payload, report_progress):
+    report_progress({"stage": "publishing"})
+    request = PostRequest(content=payload["content"], media_type=payload["media_type"])
+    return await post_to_all(request, payload.get("media_url"))
+
+# Analysis jobs depend on keys held in memory, so a job whose process died is failed and
+# its upload removed; publishing is never retried either, since it could post twice
+job_queue.register("analyze", run_analyze_job, cleanup=discard_analyze_job)
+job_queue.register("publish", run_publish_job)
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_queue.stop()
+
+@app.post("/jobs/analyze", openapi_extra=ANALYZE_FORM_OPENAPI)
+async def submit_analyze_job(request: Request, api_key: str = None, groq_api_key: str = None):
+    # Write the upload straight to where the job will read it
+    os.makedirs(JOBS_MEDIA_DIR, exist_ok=True)
+    options, upload = await read_analyze_form(request, directory=JOBS_MEDIA_DIR)
+    try:
+        check_caption_llm(options.llm_type, api_key)
+        media_path = upload.keep()
+    finally:
+        upload.close()
+
+    secrets_id = uuid.uuid4().hex
+    job_secrets[secrets_id] = {"api_key": api_key, "groq_api_key": groq_api_key}
+    payload = {
+        "path": media_path,
+        "upload_hash": upload.sha256,
+        "is_video": options.is_video,
+        "interval": options.interval,
+        "max_frames": options.max_frames,
+        "llm_type": options.llm_type,
+        "secrets_id": secrets_id,
+    }
+    try:
+        job_id = job_queue.submit("analyze", payload, pinned=True)
+    except ValueError as e:
+        discard_analyze_job(payload)
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job_id}
+
+@app.post("/jobs/publish")
+async def submit_publish_job(request: PostRequest, media_url: str = Form(None)):
+    job_id = job_queue.submit("publish", {
+        "content": request.content,
+        "media_type": request.media_type,
+        "media_url": media_url,
+    })
+    return {"job_id": job_id}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 if __name__ == "__main__":
     import uvicorn